@@ -1,22 +1,35 @@
-from decouple import config
 import os
 import requests
-import json
+import http_client
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, send_file
-import pandas as pd
-from datetime import datetime
+from flask import Flask, request, jsonify
 import logging
 import time
+from fetcher import fetch_concurrently, iter_concurrently, fetch_options
+from providers import TokovoucherProvider
+from price_store import PriceStore, PRICE_DB_FILE, changes_response
+from poll_planner import PollPlanner
+from history_store import HistoryStore, HISTORY_DIR, history_response
+from diff_engine import detect_price_change
+from product_cache import product_cache
+from metrics import install_metrics, summarize
+from exporter import parse_format, export_filename, render_export
+from export_cache import ExportCache
+from notifier import build_messages
+from outbox import Outbox, content_key
+from pipeline import run_pipeline
+from watchlists import WatchlistStore, request_codes
 
 # Logging setup
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
 
 app = Flask(__name__)
+install_metrics(app)
 load_dotenv('/home/ubuntu/python/.env', override=True)
 
 # Base URL for the API
-BASE_URL = "https://api.tokovoucher.net/produk/code"
+BASE_URL = os.getenv("TOKOVOUCHER_BASE_URL", "https://api.tokovoucher.net/produk/code")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
 
 # Load environment variables
 MEMBER_CODE = os.getenv("MEMBER_CODE")
@@ -24,101 +37,120 @@ SIGNATURE = os.getenv("SIGNATURE")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
+# Legacy JSON baseline, imported once into the price database
 DATA_FILE = "data_old.json"
-
-# Function to send messages to Telegram with retry
-def send_telegram_message(message, retries=3):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    payload = {"chat_id": TELEGRAM_CHAT_ID, "text": message, "parse_mode": "HTML"}
+price_store = PriceStore(PRICE_DB_FILE, legacy_json=DATA_FILE)
+# Change history per kode, used to skip codes whose price has been stable
+poll_planner = PollPlanner(PRICE_DB_FILE)
+# Every observed price, in monthly Parquet partitions (served by /history)
+history_store = HistoryStore(HISTORY_DIR)
+# Rendered exports by content hash, so unchanged data is not rendered again
+export_cache = ExportCache()
+# Named code lists (managed through check_price.py), usable as ?watchlist=name
+watchlist_store = WatchlistStore(PRICE_DB_FILE)
+
+# Function to send messages to Telegram with retry; returns True once delivered
+def send_telegram_message(message, chat_id=None, retries=3):
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendMessage"
+    payload = {"chat_id": chat_id or TELEGRAM_CHAT_ID, "text": message, "parse_mode": "HTML"}
     for attempt in range(retries):
         try:
-            response = requests.post(url, data=payload)
+            response = http_client.post(url, data=payload)
             if response.status_code == 200:
-                return
+                return True
             logging.error(f"Retry {attempt + 1}/{retries} failed: {response.status_code}")
         except requests.exceptions.RequestException as e:
             logging.error(f"Error during Telegram message send: {e}")
-        time.sleep(2)
+        if attempt + 1 < retries:
+            time.sleep(2)
     logging.error("Failed to send Telegram message after retries.")
+    return False
 
-# Function to send files to Telegram with retry
-def send_telegram_file(file_path, caption, retries=3):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendDocument"
+# Function to send files to Telegram with retry (content is the file bytes, nothing is written to disk)
+def send_telegram_file(filename, content, caption, chat_id=None, retries=3):
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendDocument"
     for attempt in range(retries):
         try:
-            with open(file_path, "rb") as file:
-                files = {"document": file}
-                data = {"chat_id": TELEGRAM_CHAT_ID, "caption": caption}
-                response = requests.post(url, data=data, files=files)
-                if response.status_code == 200:
-                    return
-                logging.error(f"Retry {attempt + 1}/{retries} failed: {response.status_code}")
+            files = {"document": (filename, content)}
+            data = {"chat_id": chat_id or TELEGRAM_CHAT_ID, "caption": caption}
+            response = http_client.post(url, data=data, files=files)
+            if response.status_code == 200:
+                return True
+            logging.error(f"Retry {attempt + 1}/{retries} failed: {response.status_code}")
         except requests.exceptions.RequestException as e:
             logging.error(f"Error during Telegram file send: {e}")
-        time.sleep(2)
+        if attempt + 1 < retries:
+            time.sleep(2)
     logging.error("Failed to send Telegram file after retries.")
+    return False
+
+# Persistent outbox: handlers only store notifications, a background worker sends them with backoff
+outbox = Outbox(
+    lambda chat_id, text: send_telegram_message(text, chat_id, retries=1),
+    lambda chat_id, filename, content, caption: send_telegram_file(filename, content, caption, chat_id, retries=1),
+)
+
+# Supplier used for the price checks
+tokovoucher = TokovoucherProvider(base_url=BASE_URL, member_code=MEMBER_CODE, signature=SIGNATURE)
+
+# Function to fetch a single code (exceptions are logged and turned into error records by the fetcher)
+def fetch_single_code(code, timeout):
+    item = tokovoucher.fetch(code, timeout)
+    if item is None:
+        logging.warning(f"No data for code {code}")
+    elif item["price"] == "Error":
+        logging.error(f"Error fetching data for code {code}")
+    return item
 
 # Function to fetch data
-def fetch_code_data(codes):
-    data = []
-    for code in codes:
-        url = f"{BASE_URL}?member_code={MEMBER_CODE}&signature={SIGNATURE}&kode={code}"
-        try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                json_data = response.json()
-                if "data" in json_data and len(json_data["data"]) > 0:
-                    produk_data = json_data["data"][0]
-                    nama_produk = produk_data.get("nama_produk", "N/A")
-                    price = produk_data.get("price", "N/A")
-                    data.append({"kode": code, "nama_produk": nama_produk, "price": price})
-                else:
-                    logging.warning(f"No data for code {code}")
-            else:
-                logging.error(f"Error fetching data for code {code}: {response.status_code}")
-                data.append({"kode": code, "nama_produk": "Error", "price": "Error"})
-        except Exception as e:
-            logging.error(f"Exception during fetch for code {code}: {e}")
-            data.append({"kode": code, "nama_produk": "Error", "price": "Error"})
-    return data
+def fetch_code_data(codes, max_workers=None, timeout=None):
+    return fetch_concurrently(codes, fetch_single_code, max_workers, timeout)
+
+# Function to fetch data through the shared product cache
+def fetch_code_data_cached(codes, max_workers=None, timeout=None):
+    return product_cache.get_many(codes, lambda missing: fetch_code_data(missing, max_workers, timeout))
+
+# Function to stream fetched records as they arrive
+def iter_code_data(codes, max_workers=None, timeout=None):
+    return iter_concurrently(codes, fetch_single_code, max_workers, timeout)
+
+# Function to stream fetched records through the shared product cache (codes answered from the cache
+# are added to `served` when given)
+def iter_code_data_cached(codes, max_workers=None, timeout=None, served=None):
+    return product_cache.iter_many(codes, lambda missing: iter_code_data(missing, max_workers, timeout), served)
+
+# Function to stream records fetched from upstream (never from the cache) and refresh the cache with them
+def iter_code_data_refreshed(codes, max_workers=None, timeout=None):
+    return product_cache.iter_refreshed(codes, lambda codes: iter_code_data(codes, max_workers, timeout))
 
 # Function to read old data
-def read_old_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r") as file:
-            return json.load(file)
-    else:
-        with open(DATA_FILE, "w") as file:
-            json.dump({}, file)
-    return {}
+def read_old_data(codes=None):
+    return price_store.load(codes)
 
-# Function to save new data
+# Function to save new data (only changed rows are written)
 def save_new_data(data):
-    with open(DATA_FILE, "w") as file:
-        json.dump(data, file, indent=4)
-
-# Function to detect price changes
-def detect_price_change(new_data, old_data):
-    changed = []
-    unchanged = []
-    for item in new_data:
-        kode = item["kode"]
-        new_price = item["price"]
-        old_price = old_data.get(kode, {}).get("price")
-        if new_price != old_price:
-            changed.append({
-                "kode": kode,
-                "nama_produk": item["nama_produk"],
-                "price_baru": new_price,
-                "price_lama": old_price if old_price else "N/A"
-            })
-        else:
-            unchanged.append({
-                "kode": kode,
-                "nama_produk": item["nama_produk"],
-                "price": new_price
-            })
-    return changed, unchanged
+    price_store.save(data.values())
+
+# Function to check prices in streamed micro-batches: each batch is diffed and saved in one write
+# transaction (concurrent workers never alert on the same change) and on_changes(changed) runs per batch
+def check_prices(codes, on_changes=None, fresh=False, collect=False, max_workers=None, timeout=None):
+    # fresh=1 fetches every code from upstream; cached prices are only exported on regular requests,
+    # never diffed or saved as the baseline (see from_cache in run_pipeline)
+    from_cache = set()
+    if fresh:
+        stream = lambda due: iter_code_data_refreshed(due, max_workers, timeout)
+    else:
+        stream = lambda due: iter_code_data_cached(due, max_workers, timeout, from_cache)
+    return run_pipeline(codes, stream, read_old_data,
+                        save_new_data, lock=price_store.locked, diff=detect_price_change, planner=poll_planner,
+                        history=history_store, on_changes=on_changes, fresh=fresh, collect=collect,
+                        from_cache=from_cache)
+
+# Function to queue the alerts of one batch as soon as it is saved
+def notify_changes(changed):
+    messages = build_messages(changed)
+    logging.debug(f"Menyimpan {len(messages)} pesan ke outbox Telegram.")
+    outbox.add_messages(TELEGRAM_CHAT_ID, messages)
 
 # Flask endpoint to handle Excel export
 @app.route('/export_xlsx', methods=['GET'])
@@ -126,65 +158,87 @@ def export_xlsx():
     try:
         logging.debug("Endpoint /export_xlsx diakses.")
         
-        # Mendapatkan kode dari parameter query
-        codes = request.args.get('codes', '').split(',')
-        logging.debug(f"Codes yang diterima: {codes}")
+        # Mendapatkan kode dari parameter query (codes dan/atau watchlist), tanpa duplikat
+        try:
+            codes = request_codes(request.args, watchlist_store)
+            fmt = parse_format(request.args.get('format'))
+            max_workers, timeout = fetch_options(request.args)
+        except ValueError as e:
+            logging.error(f"Parameter tidak valid: {e}")
+            return jsonify({"error": str(e)}), 400
+        logging.debug(f"Codes yang diterima: {summarize(codes)}")
         
         if not codes:
             logging.error("Tidak ada kode yang diberikan.")
             return jsonify({"error": "No codes provided"}), 400
 
-        # Fetch data
-        logging.debug("Mulai mengambil data dari API.")
-        new_data = fetch_code_data(codes)
-        logging.debug(f"Data yang diambil: {new_data}")
-
-        # Read old data
-        logging.debug("Membaca data lama.")
-        old_data = read_old_data()
-        logging.debug(f"Data lama: {old_data}")
-
-        # Detect price changes
-        logging.debug("Mendeteksi perubahan harga.")
-        changed, _ = detect_price_change(new_data, old_data)
-        logging.debug(f"Data dengan perubahan harga: {changed}")
-
-        # Kirim notifikasi Telegram hanya jika ada perubahan
-        if changed:
-            message = "<b>Perubahan Harga Terdeteksi:</b>\n"
-            for item in changed:
-                message += (f"- Kode: <b>{item['kode']}</b>\n"
-                            f"  Nama: {item['nama_produk']}\n"
-                            f"  Harga Lama: <s>{item['price_lama']}</s>\n"
-                            f"  Harga Baru: <b>{item['price_baru']}</b>\n\n")
-            logging.debug("Mengirim pesan ke Telegram.")
-            send_telegram_message(message)
-
-            # Save Excel file dan kirim ke Telegram
-            logging.debug("Menyimpan data ke file Excel.")
-            excel_file = f"Mobile_Legends_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            df = pd.DataFrame(new_data)
-            df.to_excel(excel_file, index=False)
-            logging.debug(f"File Excel disimpan: {excel_file}")
-
-            # Kirim file Excel ke Telegram
-            logging.debug("Mengirim file Excel ke Telegram.")
+        # Fetch, diff dan simpan per batch, hanya kode yang sudah jatuh tempo (fresh=1 untuk mengambil semua).
+        # Notifikasi perubahan dikirim ke outbox per batch, tanpa menunggu seluruh katalog selesai.
+        logging.debug(f"Mulai memproses {len(codes)} kode.")
+        result = check_prices(codes, on_changes=notify_changes, fresh=request.args.get('fresh') == '1',
+                              collect=True, max_workers=max_workers, timeout=timeout)
+        logging.debug(f"Hasil pengecekan: {result.counts()}")
+
+        # Kirim file export hanya jika ada perubahan
+        if result.changed:
+            # Buat file export di memori dan kirim ke Telegram
+            logging.debug("Membuat file export di memori.")
+            export_file = export_filename("Mobile_Legends", fmt)
+            content = export_cache.get_or_render(result.records, fmt, render_export)
+            logging.debug(f"File export dibuat: {export_file} ({len(content)} bytes)")
+
+            # Simpan file export ke outbox, dedup berdasarkan isi perubahan (file Excel berisi timestamp)
+            logging.debug("Menyimpan file export ke outbox Telegram.")
             caption = "File Excel berhasil diekspor dan berisi data terbaru."
-            send_telegram_file(excel_file, caption)
+            outbox.add_document(TELEGRAM_CHAT_ID, export_file, content, caption,
+                                dedup_key=content_key("document", fmt, result.change_key()))
         else:
             logging.info("Tidak ada perubahan harga, file Excel tidak dikirim.")
 
-        # Save new data
-        logging.debug("Menyimpan data baru ke file JSON.")
-        save_new_data({item["kode"]: item for item in new_data})
-
         return jsonify({"message": "Proses selesai, periksa Telegram jika ada perubahan harga."})
 
     except Exception as e:
         error_message = f"Error dalam proses: {e}"
         logging.error(error_message, exc_info=True)
-        send_telegram_message(error_message)
+        outbox.add_message(TELEGRAM_CHAT_ID, error_message)
         return jsonify({"error": error_message}), 500
 
+# Flask endpoint for the price history of one kode, downsampled per bucket (min/max/last)
+@app.route('/history', methods=['GET'])
+def history():
+    try:
+        return jsonify(history_response(history_store, request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+# Flask endpoint for the price changes after a cursor (?since=<cursor>&limit=), for incremental sync
+@app.route('/changes', methods=['GET'])
+def changes():
+    try:
+        return jsonify(changes_response(price_store, request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+# Flask endpoint to show the adaptive polling state
+@app.route('/poll_stats', methods=['GET'])
+def poll_stats():
+    return jsonify(poll_planner.stats())
+
+# Flask endpoint to show how many notifications are pending, sent or failed
+@app.route('/outbox_stats', methods=['GET'])
+def outbox_stats():
+    return jsonify(outbox.stats())
+
+# Flask endpoint to expose product cache counters
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(product_cache.stats())
+
+# Flask endpoint to show the export cache (files, bytes, hit ratio, retention limits)
+@app.route('/export_stats', methods=['GET'])
+def export_stats():
+    return jsonify(export_cache.stats())
+
 if __name__ == "__main__":
+    outbox.start()
     app.run(host="0.0.0.0", port=5001)
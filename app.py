@@ -1,70 +1,95 @@
-from flask import Flask, request, jsonify, send_file
-import requests
-import pandas as pd
+import os
+from flask import Flask, Response, request, jsonify
+from fetcher import fetch_concurrently, fetch_options
+from providers import TokovoucherProvider
+from product_cache import product_cache
+from metrics import install_metrics
+from exporter import parse_format, export_response
+from records import snapshot_version
+from export_cache import ExportCache
+from watchlists import request_codes
 
 app = Flask(__name__)
+install_metrics(app)
+
+# Rendered exports by content hash, so unchanged data is not rendered again
+export_cache = ExportCache()
 
 # Base URL for the API
-BASE_URL = "your_base_url"
+BASE_URL = os.getenv("TOKOVOUCHER_BASE_URL", "your_base_url")
 
 # Dummy member code and signature (replace with actual credentials)
 MEMBER_CODE = "your_member_code"
 SIGNATURE = "your_signature"
 
-# Function to fetch data
-def fetch_code_data(codes):
-    data = []
-    for code in codes:
-        url = f"{BASE_URL}?member_code={MEMBER_CODE}&signature={SIGNATURE}&kode={code}"
-        response = requests.get(url)
-
-        # Debugging untuk melihat isi respons
-        print(f"Response for code {code}: {response.text}")
+# Supplier used by this service
+tokovoucher = TokovoucherProvider(base_url=BASE_URL, member_code=MEMBER_CODE, signature=SIGNATURE)
 
-        if response.status_code == 200:
-            json_data = response.json()
+# Function to fetch a single code; codes without data are listed with "N/A"
+def fetch_single_code(code, timeout):
+    return tokovoucher.fetch(code, timeout) or {"kode": code, "nama_produk": "N/A", "price": "N/A"}
 
-            # Pastikan 'data' ada dan tidak kosong
-            if "data" in json_data and len(json_data["data"]) > 0:
-                produk_data = json_data["data"][0]  # Ambil elemen pertama
-                nama_produk = produk_data.get("nama_produk", "N/A")
-                price = produk_data.get("price", "N/A")
-            else:
-                nama_produk = "N/A"
-                price = "N/A"
+# Function to fetch data
+def fetch_code_data(codes, max_workers=None, timeout=None):
+    return fetch_concurrently(codes, fetch_single_code, max_workers, timeout)
 
-            data.append({"kode": code, "nama_produk": nama_produk, "price": price})
-        else:
-            data.append({"kode": code, "nama_produk": "Error", "price": "Error"})
-    return data
+# Function to fetch data through the shared product cache
+def fetch_code_data_cached(codes, max_workers=None, timeout=None):
+    return product_cache.get_many(codes, lambda missing: fetch_code_data(missing, max_workers, timeout))
 
 
 @app.route('/get_codes', methods=['GET'])
 def get_codes():
-    # Get codes from query parameters, or use default
-    codes = request.args.get('codes').split(',')
+    # Get codes from query parameters (validated, without duplicates)
+    try:
+        codes = request_codes(request.args)
+        max_workers, timeout = fetch_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not codes:
+        return jsonify({"error": "No codes provided"}), 400
 
     # Fetch data for the codes
-    data = fetch_code_data(codes)
+    data = fetch_code_data_cached(codes, max_workers=max_workers, timeout=timeout)
+
+    # Conditional GET: the ETag is the snapshot version, unchanged data is answered with 304
+    etag = snapshot_version(data)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
 
-    return jsonify(data)
+    # Cached records are compact Product objects; the response keeps the plain dict shape
+    response = jsonify([dict(item) for item in data])
+    response.set_etag(etag)
+    return response
 
 @app.route('/export_xlsx', methods=['GET'])
 def export_xlsx():
-    # Get codes from query parameters, or use default
-    codes = request.args.get('codes').split(',')
+    # Get codes from query parameters (validated, without duplicates)
+    try:
+        codes = request_codes(request.args)
+        fmt = parse_format(request.args.get('format'))
+        max_workers, timeout = fetch_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not codes:
+        return jsonify({"error": "No codes provided"}), 400
 
     # Fetch data for the codes
-    data = fetch_code_data(codes)
+    data = fetch_code_data(codes, max_workers=max_workers, timeout=timeout)
 
-    # Convert data to a Pandas DataFrame
-    df = pd.DataFrame(data)
+    # Stream the export straight into the response (xlsx, csv or parquet)
+    return export_response(data, fmt, prefix="codes_export", cache=export_cache)
 
-    # Save to XLSX
-    file_path = "codes_export.xlsx"
-    df.to_excel(file_path, index=False)
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(product_cache.stats())
 
-    return send_file(file_path, as_attachment=True)
+# Flask endpoint to show the export cache (files, bytes, hit ratio, retention limits)
+@app.route('/export_stats', methods=['GET'])
+def export_stats():
+    return jsonify(export_cache.stats())
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    app.run(debug=os.getenv("FLASK_DEBUG", "0") == "1")
@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import importlib
+import contextlib
+import tempfile
+import functools
+import threading
+import tracemalloc
+
+from mock_upstream import MockConfig, start_mock_server, mock_environment
+
+DEFAULT_SIZES = [10, 1000, 50000]
+
+# Module functions timed as pipeline stages, by stage name
+STAGE_FUNCTIONS = {
+    "fetch": ["fetch_code_data", "fetch_code_data_cached"],
+    "load_old": ["read_old_data"],
+    "diff": ["detect_price_change"],
+    "export": ["render_export", "export_response"],
+    "telegram": ["send_telegram_message", "send_telegram_file"],
+    "save": ["save_new_data"],
+    "notify": ["notify_changes"],
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+# Collects per-stage call durations, per-code upstream latency and peak traced memory
+class StageRecorder:
+    def __init__(self, track_memory=True):
+        self.track_memory = track_memory
+        self.stages = {}
+        self.code_latencies = []
+        self.started = time.perf_counter()
+        self.first_call = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stage(self, name):
+        return self.stages.setdefault(name, {"calls": [], "peak_bytes": 0})
+
+    def wrap_stage(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Only the outermost stage is measured (fetch_code_data_cached calls fetch_code_data)
+            depth = getattr(self._local, "depth", 0)
+            outer = depth == 0
+            self._local.depth = depth + 1
+            if outer and self.track_memory:
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            with self._lock:
+                self.first_call.setdefault(name, start - self.started)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.depth = depth
+                if outer:
+                    with self._lock:
+                        stage = self._stage(name)
+                        stage["calls"].append(time.perf_counter() - start)
+                        if self.track_memory:
+                            stage["peak_bytes"] = max(stage["peak_bytes"], tracemalloc.get_traced_memory()[1])
+        return wrapper
+
+    def wrap_code_fetch(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.code_latencies.append(elapsed)
+        return wrapper
+
+    # Function to wrap the stage functions of an entry-point module; returns a restore callback
+    def instrument(self, module):
+        originals = {}
+        for stage, names in STAGE_FUNCTIONS.items():
+            for name in names:
+                if hasattr(module, name):
+                    originals[name] = getattr(module, name)
+                    setattr(module, name, self.wrap_stage(stage, originals[name]))
+        if hasattr(module, "fetch_single_code"):
+            originals["fetch_single_code"] = module.fetch_single_code
+            module.fetch_single_code = self.wrap_code_fetch(module.fetch_single_code)
+
+        def restore():
+            for name, func in originals.items():
+                setattr(module, name, func)
+        return restore
+
+    def report(self, codes_count, total_seconds):
+        # Streamed pipelines have no single fetch call; report the per-code upstream time instead
+        if self.code_latencies and "fetch" not in self.stages:
+            self._stage("fetch")["calls"] = list(self.code_latencies)
+        stages = {}
+        for name, stage in self.stages.items():
+            calls = stage["calls"]
+            samples = self.code_latencies if name == "fetch" and self.code_latencies else calls
+            stages[name] = {
+                "calls": len(calls),
+                "seconds": round(sum(calls), 4),
+                "p50_ms": round(percentile(samples, 50) * 1000, 2),
+                "p99_ms": round(percentile(samples, 99) * 1000, 2),
+                "peak_mb": round(stage["peak_bytes"] / 1e6, 2) if self.track_memory else None,
+            }
+        alerts = [name for name in ("notify", "telegram") if name in self.first_call]
+        return {
+            "codes": codes_count,
+            "seconds": round(total_seconds, 3),
+            "codes_per_second": round(codes_count / total_seconds, 1) if total_seconds else None,
+            # Time until the first change alert was handed to Telegram (queued or sent)
+            "first_alert_seconds": round(min(self.first_call[name] for name in alerts), 3) if alerts else None,
+            "stages": stages,
+        }
+
+
+# Pipelines under test: name -> (module name, runner(module, codes))
+def _flask_get(path):
+    def run(module, codes):
+        client = module.app.test_client()
+        response = client.get(path, query_string={"codes": ",".join(codes)})
+        response.get_data()
+        response.close()
+        if response.status_code >= 400:
+            raise RuntimeError(f"{path} -> {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return run
+
+
+PIPELINES = {
+    "ML.py /export_xlsx": ("ML", _flask_get("/export_xlsx")),
+    "check_price.py /export_xlsx": ("check_price", _flask_get("/export_xlsx")),
+    "check_price.py main": ("check_price", lambda module, codes: module.run_check(codes)),
+    "price_monitor.py check": ("price_monitor", lambda module, codes: module.check_prices(
+        codes, on_changes=module.notify_changes)),
+    "app.py /get_codes": ("app", _flask_get("/get_codes")),
+    "app.py /export_xlsx": ("app", _flask_get("/export_xlsx")),
+}
+
+
+# Function to run one pipeline at one catalog size against a fresh price database
+# (codes defaults to the first `size` simulator codes)
+def run_pipeline(name, size, workdir, track_memory=True, codes=None):
+    from product_cache import product_cache
+    from fetcher import single_flight
+    from upstream_guard import upstream_breaker
+    from price_store import PriceStore
+    from poll_planner import PollPlanner
+    from history_store import HistoryStore
+
+    module_name, runner = PIPELINES[name]
+    module = importlib.import_module(module_name)
+    codes = MockConfig().catalog_codes(size) if codes is None else codes
+    original_store = getattr(module, "price_store", None)
+    original_planner = getattr(module, "poll_planner", None)
+    safe_name = "".join(ch if ch.isalnum() else "_" for ch in name)
+    db_path = os.path.join(workdir, f"{safe_name}_{size}.db")
+    if original_store is not None:
+        module.price_store = PriceStore(db_path)
+    if original_planner is not None:
+        module.poll_planner = PollPlanner(db_path)
+    original_history = getattr(module, "history_store", None)
+    if original_history is not None:
+        module.history_store = HistoryStore(os.path.join(workdir, f"{safe_name}_{size}_history"))
+
+    product_cache.invalidate()
+    single_flight.clear()
+    upstream_breaker.reset()
+    recorder = StageRecorder(track_memory)
+    restore = recorder.instrument(module)
+    start = time.perf_counter()
+    try:
+        # app.py and check_price.py print every upstream/Telegram response
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            runner(module, codes)
+            # Handlers return before queued Telegram messages are delivered; count them in the run
+            if hasattr(module, "telegram_queue"):
+                module.telegram_queue.join()
+            if hasattr(module, "outbox"):
+                module.outbox.drain()
+    finally:
+        total = time.perf_counter() - start
+        restore()
+        if original_store is not None:
+            module.price_store = original_store
+        if original_planner is not None:
+            module.poll_planner = original_planner
+        if original_history is not None:
+            module.history_store = original_history
+    return recorder.report(size, total)
+
+
+def print_report(name, report):
+    print(f"\n{name}: {report['codes']} kode, {report['seconds']} s, {report['codes_per_second']} kode/s, "
+          f"first alert {report['first_alert_seconds']} s")
+    print(f"  {'stage':<10}{'calls':>7}{'total s':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}")
+    for stage, row in report["stages"].items():
+        peak = "-" if row["peak_mb"] is None else row["peak_mb"]
+        print(f"  {stage:<10}{row['calls']:>7}{row['seconds']:>10}{row['p50_ms']:>10}{row['p99_ms']:>10}{peak:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load benchmark against the local upstream simulator")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--pipelines", default=",".join(PIPELINES), help="comma separated pipeline names")
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--latency-jitter", type=float, default=0.002)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--upstream-rate", type=float, default=0.0,
+                        help="UPSTREAM_RATE for the token bucket (0 = unlimited, measures raw throughput)")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (it slows the fetch stage)")
+    parser.add_argument("--json", help="write the full report to this file")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    config = MockConfig(catalog_size=max(sizes), latency=args.latency, latency_jitter=args.latency_jitter,
+                        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+    server = start_mock_server(config)
+    workdir = tempfile.mkdtemp(prefix="price-bench-")
+    json_path = os.path.abspath(args.json) if args.json else None
+    os.environ.update(mock_environment(server))
+    os.environ["PRICE_DB_FILE"] = os.path.join(workdir, "prices.db")
+    os.environ["UPSTREAM_RATE"] = str(args.upstream_rate)
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    names = [name.strip() for name in args.pipelines.split(",") if name.strip()]
+    for name in names:
+        importlib.import_module(PIPELINES[name][0])
+    # ML.py switches the root logger to DEBUG and logs full payloads; keep the run quiet
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if not args.no_memory:
+        tracemalloc.start()
+    results = {}
+    for name in names:
+        for size in sizes:
+            report = run_pipeline(name, size, workdir, track_memory=not args.no_memory)
+            results.setdefault(name, []).append(report)
+            print_report(name, report)
+    server.shutdown()
+
+    print(f"\nUpstream simulator: {server.snapshot_stats()}")
+    if json_path:
+        with open(json_path, "w") as file:
+            json.dump(results, file, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
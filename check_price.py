@@ -1,16 +1,29 @@
-from decouple import config
 import os
+import io
 import requests
-import json
+import http_client
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, send_file
-import pandas as pd
+from fetcher import fetch_concurrently, iter_concurrently, fetch_options
+from providers import TokovoucherProvider, SupplierRouter, load_providers, best_price_response
+from price_store import PriceStore, PRICE_DB_FILE, changes_response
+from poll_planner import PollPlanner
+from history_store import HistoryStore, HISTORY_DIR, history_response
+from diff_engine import detect_price_change
+from product_cache import product_cache
+from metrics import install_metrics
+from scheduler import Scheduler, LeaderLock
+from notifier import build_messages, build_summary, TELEGRAM_UNCHANGED_MODE
+from outbox import Outbox, content_key, OUTBOX_DRAIN_TIMEOUT
+from exporter import EXPORT_FORMATS, parse_format, export_filename, render_export
+from export_cache import ExportCache
+from pipeline import run_pipeline
+from watchlists import WatchlistStore, watchlist_put, request_codes, union_codes
 
-app = Flask(__name__)
 load_dotenv('/home/ubuntu/python/.env', override=True)
 
 # Base URL for the API
-BASE_URL = "https://api.tokovoucher.net/produk/code"
+BASE_URL = os.getenv("TOKOVOUCHER_BASE_URL", "https://api.tokovoucher.net/produk/code")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
 
 # Load environment variables
 MEMBER_CODE = os.getenv("MEMBER_CODE")
@@ -18,176 +31,344 @@ SIGNATURE = os.getenv("SIGNATURE")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
+# Legacy JSON baseline, imported once into the price database
 DATA_FILE = "data_old.json"
+price_store = PriceStore(PRICE_DB_FILE, legacy_json=DATA_FILE)
+# Change history per kode, used to skip codes whose price has been stable
+poll_planner = PollPlanner(PRICE_DB_FILE)
+# Every observed price, in monthly Parquet partitions (served by /history)
+history_store = HistoryStore(HISTORY_DIR)
+# Rendered exports by content hash, so unchanged data is not rendered again
+export_cache = ExportCache()
+# Named code lists checked by the scheduled job (managed through /watchlists)
+watchlist_store = WatchlistStore(PRICE_DB_FILE)
 
-# Function to send messages to Telegram
-def send_telegram_message(message):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    payload = {"chat_id": TELEGRAM_CHAT_ID, "text": message, "parse_mode": "HTML"}
+# Codes checked by main() and by the scheduled job while no watchlist is active
+DEFAULT_CODES = ["MLAWP1", "MLA12976", "MLA2195", "MLA1412", "MLA1220", "MLA878", "MLBB716"]
+SCHEDULE_CODES = [code for code in os.getenv("SCHEDULE_CODES", ",".join(DEFAULT_CODES)).split(",") if code]
+# Only one process runs the scheduled check when several workers enable the scheduler
+scheduler = Scheduler(LeaderLock())
+
+# Function to send messages to Telegram; returns True once delivered
+def send_telegram_message(message, chat_id=None):
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendMessage"
+    payload = {"chat_id": chat_id or TELEGRAM_CHAT_ID, "text": message, "parse_mode": "HTML"}
     try:
-        response = requests.post(url, data=payload)
+        response = http_client.post(url, data=payload)
         print(f"Response Telegram: {response.status_code} - {response.text}")
+        return response.status_code == 200
     except requests.exceptions.RequestException as e:
         print(f"Error saat mengirim notifikasi Telegram: {e}")
+        return False
 
-# Function to send files to Telegram
-def send_telegram_file(file_path, caption):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendDocument"
+# Function to send files to Telegram (content is the file bytes, nothing is written to disk)
+def send_telegram_file(filename, content, caption, chat_id=None):
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendDocument"
     try:
-        with open(file_path, "rb") as file:
-            files = {"document": file}
-            data = {"chat_id": TELEGRAM_CHAT_ID, "caption": caption}
-            response = requests.post(url, data=data, files=files)
-            print(f"Response Telegram File: {response.status_code} - {response.text}")
+        files = {"document": (filename, content)}
+        data = {"chat_id": chat_id or TELEGRAM_CHAT_ID, "caption": caption}
+        response = http_client.post(url, data=data, files=files)
+        print(f"Response Telegram File: {response.status_code} - {response.text}")
+        return response.status_code == 200
     except requests.exceptions.RequestException as e:
         print(f"Error saat mengirim file ke Telegram: {e}")
+        return False
+
+# Persistent outbox: notifications are stored first and sent by a background worker with backoff
+outbox = Outbox(
+    lambda chat_id, text: send_telegram_message(text, chat_id),
+    lambda chat_id, filename, content, caption: send_telegram_file(filename, content, caption, chat_id),
+)
+
+# Supplier used for the price checks
+tokovoucher = TokovoucherProvider(base_url=BASE_URL, member_code=MEMBER_CODE, signature=SIGNATURE)
+# Every configured supplier (PROVIDERS), queried concurrently for /best_price
+supplier_router = SupplierRouter(load_providers())
+
+# Function to fetch a single code
+def fetch_single_code(code, timeout):
+    return tokovoucher.fetch(code, timeout)
 
 # Function to fetch data
-def fetch_code_data(codes):
-    data = []
-    for code in codes:
-        url = f"{BASE_URL}?member_code={MEMBER_CODE}&signature={SIGNATURE}&kode={code}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            json_data = response.json()
-            if "data" in json_data and len(json_data["data"]) > 0:
-                produk_data = json_data["data"][0]
-                nama_produk = produk_data.get("nama_produk", "N/A")
-                price = produk_data.get("price", "N/A")
-                data.append({"kode": code, "nama_produk": nama_produk, "price": price})
-        else:
-            data.append({"kode": code, "nama_produk": "Error", "price": "Error"})
-    return data
+def fetch_code_data(codes, max_workers=None, timeout=None):
+    return fetch_concurrently(codes, fetch_single_code, max_workers, timeout)
+
+# Function to fetch data through the shared product cache
+def fetch_code_data_cached(codes, max_workers=None, timeout=None):
+    return product_cache.get_many(codes, lambda missing: fetch_code_data(missing, max_workers, timeout))
+
+# Function to stream fetched records as they arrive
+def iter_code_data(codes, max_workers=None, timeout=None):
+    return iter_concurrently(codes, fetch_single_code, max_workers, timeout)
+
+# Function to stream fetched records through the shared product cache (codes answered from the cache
+# are added to `served` when given)
+def iter_code_data_cached(codes, max_workers=None, timeout=None, served=None):
+    return product_cache.iter_many(codes, lambda missing: iter_code_data(missing, max_workers, timeout), served)
+
+# Function to stream records fetched from upstream (never from the cache) and refresh the cache with them
+def iter_code_data_refreshed(codes, max_workers=None, timeout=None):
+    return product_cache.iter_refreshed(codes, lambda codes: iter_code_data(codes, max_workers, timeout))
 
 # Function to read old data
-def read_old_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r") as file:
-            return json.load(file)
-    return {}
+def read_old_data(codes=None):
+    return price_store.load(codes)
 
-# Function to save new data
+# Function to save new data (only changed rows are written)
 def save_new_data(data):
-    with open(DATA_FILE, "w") as file:
-        json.dump(data, file, indent=4)
-
-# Function to detect price changes
-def detect_price_change(new_data, old_data):
-    changed = []
-    unchanged = []
-    for item in new_data:
-        kode = item["kode"]
-        new_price = item["price"]
-        old_price = old_data.get(kode, {}).get("price")
-        if new_price != old_price:
-            changed.append({
-                "kode": kode,
-                "nama_produk": item["nama_produk"],
-                "price_baru": new_price,
-                "price_lama": old_price if old_price else "N/A"
-            })
-        else:
-            unchanged.append({
-                "kode": kode,
-                "nama_produk": item["nama_produk"],
-                "price": new_price
-            })
-    return changed, unchanged
-
-# Flask endpoint to handle Excel export
-@app.route('/export_xlsx', methods=['GET'])
-def export_xlsx():
-    codes = request.args.get('codes', '').split(',')
-    if not codes:
-        return jsonify({"error": "No codes provided"}), 400
-
-    # Fetch data
-    new_data = fetch_code_data(codes)
-
-    # Read old data
-    old_data = read_old_data()
-
-    # Detect price changes
-    changed, unchanged = detect_price_change(new_data, old_data)
-
-    # Build notification message
-    if changed:
-        message = "<b>Perubahan Harga Terdeteksi:</b>\n"
-        for item in changed:
-            message += (f"- Kode: <b>{item['kode']}</b>\n"
-                        f"  Nama: {item['nama_produk']}\n"
-                        f"  Harga Lama: <s>{item['price_lama']}</s>\n"
-                        f"  Harga Baru: <b>{item['price_baru']}</b>\n\n")
+    price_store.save(data.values())
+
+# Function to check prices in streamed micro-batches: each batch is diffed and saved in one write
+# transaction (concurrent workers never alert on the same change) and on_changes(changed) runs per batch
+def check_prices(codes, on_changes=None, cached=False, fresh=False, collect=False, keep_unchanged=False,
+                 max_workers=None, timeout=None):
+    # fresh=1 fetches every code from upstream; cached prices are only exported on regular requests,
+    # never diffed or saved as the baseline (see from_cache in run_pipeline)
+    from_cache = set()
+    if not cached:
+        stream = lambda due: iter_code_data(due, max_workers, timeout)
+    elif fresh:
+        stream = lambda due: iter_code_data_refreshed(due, max_workers, timeout)
     else:
-        message = "<b>Tidak Ada Perubahan Harga</b>\n"
+        stream = lambda due: iter_code_data_cached(due, max_workers, timeout, from_cache)
+    return run_pipeline(codes, stream, read_old_data, save_new_data,
+                        lock=price_store.locked, diff=detect_price_change, planner=poll_planner,
+                        history=history_store, on_changes=on_changes, fresh=fresh, collect=collect,
+                        keep_unchanged=keep_unchanged, from_cache=from_cache)
 
-    if unchanged:
-        message += "<b>Produk Tanpa Perubahan Harga:</b>\n"
-        for item in unchanged:
-            message += (f"- Kode: <b>{item['kode']}</b>\n"
-                        f"  Nama: {item['nama_produk']}\n"
-                        f"  Harga: <b>{item['price']}</b>\n\n")
+# Function to queue the alerts of one batch; unchanged products go into the closing summary
+def notify_changes(changed):
+    outbox.add_messages(TELEGRAM_CHAT_ID, build_messages(changed, unchanged_mode="none"))
 
-    # Send notification to Telegram
-    send_telegram_message(message)
+# Function to queue the closing summary of a run
+def notify_summary(result):
+    unchanged = result.unchanged_items if result.unchanged_items is not None else result.unchanged
+    outbox.add_messages(TELEGRAM_CHAT_ID, build_summary(result.changed, unchanged))
 
-    # Save Excel file
-    excel_file = "exported_data.xlsx"
-    try:
-        df = pd.DataFrame(new_data)
-        df.to_excel(excel_file, index=False)
+# Function to build the Flask app; Flask is only imported when the HTTP server is used
+def create_app():
+    from flask import Flask, request, jsonify, send_file
 
-        # Send file notification to Telegram
-        caption = "File Excel berhasil diekspor dan berisi data terbaru."
-        send_telegram_file(excel_file, caption)
+    app = Flask(__name__)
+    install_metrics(app)
 
-        # Save new data
-        save_new_data({item["kode"]: item for item in new_data})
+    # Flask endpoint to handle Excel export
+    @app.route('/export_xlsx', methods=['GET'])
+    def export_xlsx():
+        try:
+            codes = request_codes(request.args, watchlist_store)
+            fmt = parse_format(request.args.get('format'))
+            max_workers, timeout = fetch_options(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not codes:
+            return jsonify({"error": "No codes provided"}), 400
 
-        return send_file(excel_file, as_attachment=True)
-    except Exception as e:
-        error_message = f"Error saat membuat atau mengirim file Excel: {e}"
-        print(error_message)
-        send_telegram_message(error_message)
-        return jsonify({"error": error_message}), 500
+        # Fetch only the codes that are due (fresh=1 fetches all); alerts are queued batch by batch
+        result = check_prices(codes, on_changes=notify_changes, cached=True, fresh=request.args.get('fresh') == '1',
+                              collect=True, keep_unchanged=TELEGRAM_UNCHANGED_MODE == "full",
+                              max_workers=max_workers, timeout=timeout)
+        notify_summary(result)
 
-# Main function for standalone execution
-def main():
-    codes = ["MLAWP1", "MLA12976", "MLA2195", "MLA1412", "MLA1220", "MLA878", "MLBB716"]
-    new_data = fetch_code_data(codes)
-
-    # Read old data
-    old_data = read_old_data()
-
-    # Detect price changes
-    changed, unchanged = detect_price_change(new_data, old_data)
-
-    # Notify changes
-    if changed:
-        message = "<b>Perubahan Harga Terdeteksi:</b>\n"
-        for item in changed:
-            message += (f"- Kode: <b>{item['kode']}</b>\n"
-                        f"  Nama: {item['nama_produk']}\n"
-                        f"  Harga Lama: <s>{item['price_lama']}</s>\n"
-                        f"  Harga Baru: <b>{item['price_baru']}</b>\n\n")
-    else:
-        message = "<b>Tidak Ada Perubahan Harga</b>\n"
+        # Build the export in memory, so concurrent requests never share a file
+        try:
+            content = export_cache.get_or_render(result.records, fmt, render_export)
+            filename = export_filename("exported_data", fmt)
+
+            # Queue the file for Telegram; the rendered file embeds a timestamp, so dedup on the changes
+            caption = "File Excel berhasil diekspor dan berisi data terbaru."
+            outbox.add_document(TELEGRAM_CHAT_ID, filename, content, caption,
+                                dedup_key=content_key("document", fmt, result.change_key()))
+
+            return send_file(io.BytesIO(content), mimetype=EXPORT_FORMATS[fmt][0],
+                             as_attachment=True, download_name=filename)
+        except Exception as e:
+            error_message = f"Error saat membuat atau mengirim file Excel: {e}"
+            print(error_message)
+            outbox.add_message(TELEGRAM_CHAT_ID, error_message)
+            return jsonify({"error": error_message}), 500
+
+    # Flask endpoint to expose product cache counters
+    @app.route('/cache_stats', methods=['GET'])
+    def cache_stats():
+        return jsonify(product_cache.stats())
+
+    # Flask endpoint to show the export cache (files, bytes, hit ratio, retention limits)
+    @app.route('/export_stats', methods=['GET'])
+    def export_stats():
+        return jsonify(export_cache.stats())
+
+    # Flask endpoint to show how many notifications are pending, sent or failed
+    @app.route('/outbox_stats', methods=['GET'])
+    def outbox_stats():
+        return jsonify(outbox.stats())
+
+    # Flask endpoint for the price history of one kode, downsampled per bucket (min/max/last)
+    @app.route('/history', methods=['GET'])
+    def history():
+        try:
+            return jsonify(history_response(history_store, request.args))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    # Flask endpoint for the price changes after a cursor (?since=<cursor>&limit=), for incremental sync
+    @app.route('/changes', methods=['GET'])
+    def changes():
+        try:
+            return jsonify(changes_response(price_store, request.args))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-    if unchanged:
-        message += "<b>Produk Tanpa Perubahan Harga:</b>\n"
-        for item in unchanged:
-            message += (f"- Kode: <b>{item['kode']}</b>\n"
-                        f"  Nama: {item['nama_produk']}\n"
-                        f"  Harga: <b>{item['price']}</b>\n\n")
+    # Flask endpoint for the cheapest supplier per code, asking every supplier concurrently
+    @app.route('/best_price', methods=['GET'])
+    def best_price():
+        try:
+            return jsonify(best_price_response(supplier_router, request.args))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-    send_telegram_message(message)
+    # Flask endpoint to show per-supplier latency, errors and how often each one is the cheapest
+    @app.route('/provider_stats', methods=['GET'])
+    def provider_stats():
+        return jsonify(supplier_router.stats())
+
+    # Flask endpoints to manage the watchlists checked by the scheduled job
+    @app.route('/watchlists', methods=['GET'])
+    def watchlists():
+        return jsonify({"watchlists": watchlist_store.list(), **watchlist_store.stats()})
+
+    @app.route('/watchlists/<name>', methods=['GET', 'PUT', 'DELETE'])
+    def watchlist(name):
+        if request.method == 'PUT':
+            try:
+                item, created = watchlist_put(watchlist_store, name, request.get_json(silent=True))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return jsonify(item), 201 if created else 200
+        if request.method == 'DELETE':
+            if not watchlist_store.delete(name):
+                return jsonify({"error": f"Watchlist tidak ditemukan: {name}"}), 404
+            return "", 204
+        item = watchlist_store.get(name)
+        if item is None:
+            return jsonify({"error": f"Watchlist tidak ditemukan: {name}"}), 404
+        return jsonify(item)
+
+    # Flask endpoint to show the adaptive polling state (tracked codes, due now, interval spread)
+    @app.route('/poll_stats', methods=['GET'])
+    def poll_stats():
+        return jsonify(poll_planner.stats())
+
+    # Flask endpoint to show scheduled job status (last run, duration, overlaps skipped)
+    @app.route('/scheduler', methods=['GET'])
+    def scheduler_status():
+        return jsonify(scheduler.status())
+
+    return app
+
+_app = None
+
+# Module attribute `app` (gunicorn check_price:app, benchmark) builds the Flask app on first access
+def __getattr__(name):
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Check the price list once and notify Telegram
+def run_check(codes):
+    # Alerts are queued as soon as a batch with changes is saved; the summary follows at the end
+    result = check_prices(codes, on_changes=notify_changes, keep_unchanged=TELEGRAM_UNCHANGED_MODE == "full")
+    if not result.fetched:
+        print("Tidak ada kode yang perlu dicek pada siklus ini.")
+        return
+    print(f"Mengecek {result.fetched} dari {result.fetched + result.skipped} kode, {result.changed} perubahan harga.")
+    notify_summary(result)
+
+    # Give the outbox a chance to deliver before a CLI run exits; leftovers are sent on the next start
+    outbox.drain(timeout=OUTBOX_DRAIN_TIMEOUT)
+
+# Check every active watchlist in one cycle: each code is fetched once, even when several lists
+# contain it, then alerts and summaries go to each chat and every list gets its own export
+def run_watchlists(watchlists):
+    # Lists sharing a chat are merged, so a chat gets each change once
+    chats = {}
+    for watchlist in watchlists:
+        chats.setdefault(watchlist["chat_id"] or TELEGRAM_CHAT_ID, set()).update(watchlist["codes"])
+    changes = {}
+
+    def notify(changed):
+        for chat_id, codes in chats.items():
+            subset = [item for item in changed if item["kode"] in codes]
+            if subset:
+                changes.setdefault(chat_id, []).extend(subset)
+                outbox.add_messages(chat_id, build_messages(subset, unchanged_mode="none"))
+
+    codes = union_codes(watchlists)
+    result = check_prices(codes, on_changes=notify, collect=any(watchlist["export"] for watchlist in watchlists),
+                          keep_unchanged=True)
+    print(f"{len(watchlists)} watchlist, {len(codes)} kode unik dari "
+          f"{sum(len(watchlist['codes']) for watchlist in watchlists)}: mengecek {result.fetched}, "
+          f"{result.changed} perubahan harga.")
+
+    for chat_id, codes in chats.items():
+        unchanged = [item for item in result.unchanged_items if item["kode"] in codes]
+        changed = changes.get(chat_id, [])
+        outbox.add_messages(chat_id, build_summary(
+            len(changed), unchanged if TELEGRAM_UNCHANGED_MODE == "full" else len(unchanged)))
+
+    if result.records is not None:
+        records = {item["kode"]: item for item in result.records}
+        for watchlist in watchlists:
+            if not watchlist["export"]:
+                continue
+            chat_id = watchlist["chat_id"] or TELEGRAM_CHAT_ID
+            codes = set(watchlist["codes"])
+            rows = [records[code] for code in watchlist["codes"] if code in records]
+            changed = [f"{item['kode']}:{item['price_baru']}" for item in changes.get(chat_id, [])
+                       if item["kode"] in codes]
+            try:
+                content = export_cache.get_or_render(rows, watchlist["export"], render_export)
+            except Exception as e:
+                print(f"Error saat membuat export watchlist {watchlist['name']}: {e}")
+                continue
+            outbox.add_document(chat_id, export_filename(watchlist["name"], watchlist["export"]), content,
+                                f"Export watchlist {watchlist['name']}: {len(rows)} produk.",
+                                dedup_key=content_key("document", chat_id, watchlist["name"], watchlist["export"],
+                                                      *changed))
+
+    outbox.drain(timeout=OUTBOX_DRAIN_TIMEOUT)
+
+# Function for the scheduled check: every active watchlist, or SCHEDULE_CODES while there is none
+def run_scheduled_check():
+    watchlists = watchlist_store.active()
+    if watchlists:
+        run_watchlists(watchlists)
+    else:
+        run_check(SCHEDULE_CODES)
+
+# Main function for standalone execution
+def main():
+    run_scheduled_check()
 
-    # Save new data
-    save_new_data({item["kode"]: item for item in new_data})
+# Register the periodic price check, replacing the cron curl to /export_xlsx
+def register_jobs():
+    scheduler.add_job("check_price", run_scheduled_check)
 
 if __name__ == "__main__":
     import sys
-    if len(sys.argv) > 1 and sys.argv[1] == "flask":
-        app.run(host="0.0.0.0", port=5000)
+    mode = sys.argv[1] if len(sys.argv) > 1 else ""
+    if mode == "flask":
+        outbox.start()
+        if os.getenv("SCHEDULE_ENABLED", "0") == "1":
+            register_jobs()
+            scheduler.start()
+        create_app().run(host="0.0.0.0", port=5000)
+    elif mode == "daemon":
+        outbox.start()
+        register_jobs()
+        scheduler.run_forever()
     else:
         main()
@@ -0,0 +1,255 @@
+import os
+import math
+import logging
+from metrics import stage_timer
+from records import Product, Change
+
+# Price values returned by fetch_code_data when a lookup failed
+ERROR_PRICE = "Error"
+# Diffs smaller than this (new + old rows) run in plain Python, so small CLI runs never import pandas.
+# The streaming pipeline diffs micro-batches of PIPELINE_BATCH_SIZE (200) records, so with the defaults
+# it always takes the pure Python path; the vectorized one serves whole-snapshot diffs.
+DIFF_VECTORIZE_MIN = int(os.getenv("DIFF_VECTORIZE_MIN", "5000"))
+
+_COLUMNS = ["kode", "nama_produk", "price"]
+
+
+# Result of one diff pass; every attribute is a DataFrame
+class DiffResult:
+    def __init__(self, changed, unchanged, new, disappeared, errored):
+        self.changed = changed
+        self.unchanged = unchanged
+        self.new = new
+        self.disappeared = disappeared
+        self.errored = errored
+
+    def counts(self):
+        return {name: len(getattr(self, name))
+                for name in ("changed", "unchanged", "new", "disappeared", "errored")}
+
+
+# Function to turn product records into typed columns:
+# price_num holds the numeric price (NaN if not a number), is_error flags failed lookups
+def to_frame(records):
+    import pandas as pd
+
+    if isinstance(records, pd.DataFrame) and "price_num" in records:
+        return records
+    records = list(records)
+    # object columns keep every value as stored: an int64 price column would turn into float64
+    # (1000 -> 1000.0) as price_lama when the left merge in diff_snapshots finds a new kode
+    df = pd.DataFrame({column: pd.Series([item.get(column) for item in records], dtype=object)
+                       for column in _COLUMNS})
+    df = df.drop_duplicates("kode", keep="last")
+    df["price_num"] = pd.to_numeric(df["price"], errors="coerce")
+    df["is_error"] = (df["price"] == ERROR_PRICE).to_numpy(dtype=bool)
+    return df
+
+
+# Function to diff a new snapshot against the old one in a single vectorized pass.
+# new_data is a list of records, old_data a dict of kode -> record (as returned by read_old_data);
+# either one may also be a frame already built by to_frame.
+def diff_snapshots(new_data, old_data):
+    import numpy as np
+    import pandas as pd
+
+    new = to_frame(new_data)
+    old = to_frame(old_data if isinstance(old_data, pd.DataFrame) else old_data.values())
+
+    merged = new.merge(old, on="kode", how="left", suffixes=("", "_lama"), indicator=True)
+    # Merge instead of Series.isin, which is much slower on large string columns
+    old_only = old.merge(new[["kode"]], on="kode", how="left", indicator=True)["_merge"] == "left_only"
+    in_old = (merged["_merge"] == "both").to_numpy()
+    errored = merged["is_error"].to_numpy()
+
+    new_num = merged["price_num"].to_numpy(dtype=float)
+    old_num = merged["price_num_lama"].to_numpy(dtype=float)
+    # Numeric prices compare by value (15000 == "15000"); non-numeric ones (e.g. "N/A") by text
+    same = new_num == old_num
+    both_text = np.flatnonzero(np.isnan(new_num) & np.isnan(old_num) & in_old)
+    if len(both_text):
+        text = merged.iloc[both_text]
+        same[both_text] = (_as_text(text["price"]) == _as_text(text["price_lama"])).to_numpy()
+
+    merged["delta"] = new_num - old_num
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta_pct = np.round((new_num - old_num) / old_num * 100, 2)
+    # No percentage from an old price of 0: null instead of inf, which is not valid JSON
+    delta_pct[~np.isfinite(delta_pct)] = np.nan
+    merged["delta_pct"] = delta_pct
+    merged = merged.drop(columns=["_merge", "is_error_lama"])
+
+    result = DiffResult(
+        changed=merged[in_old & ~errored & ~same],
+        unchanged=merged[in_old & ~errored & same],
+        new=merged[~in_old & ~errored],
+        disappeared=old[old_only.to_numpy()],
+        errored=merged[errored],
+    )
+    logging.debug(f"Diff selesai: {result.counts()}")
+    return result
+
+
+# Missing prices become "None" whether the merge left None or NaN behind
+def _as_text(series):
+    series = series.astype(object)
+    return series.where(series.notna(), None).map(str)
+
+
+# Function to iterate the rows of the given columns as tuples, with NaN replaced by None
+def _rows(df, columns):
+    df = df[columns].astype(object)
+    return df.where(df.notna(), None).itertuples(index=False, name=None)
+
+
+# Function to detect price changes, returning (changed, unchanged) lists of Change and Product records
+# (read-only, with the keys of the legacy dicts).
+# New codes count as changed with price_lama "N/A"; failed lookups are reported by diff_snapshots only.
+def detect_price_change(new_data, old_data):
+    with stage_timer("diff", len(new_data)):
+        return _detect_price_change(new_data, old_data)
+
+
+def _detect_price_change(new_data, old_data):
+    if isinstance(old_data, dict) and not hasattr(new_data, "columns") \
+            and len(new_data) + len(old_data) < DIFF_VECTORIZE_MIN:
+        return _detect_price_change_small(new_data, old_data)
+    return _detect_price_change_vectorized(new_data, old_data)
+
+
+def _detect_price_change_vectorized(new_data, old_data):
+    import pandas as pd
+
+    result = diff_snapshots(new_data, old_data)
+    if len(result.errored):
+        logging.warning(f"{len(result.errored)} kode gagal diambil: {list(result.errored['kode'])}")
+
+    changed_df = pd.concat([result.changed, result.new]).sort_index()
+    changed_df = changed_df.rename(columns={"price": "price_baru"})
+    changed = [Change(kode, nama_produk, price_baru, price_lama or "N/A", delta, delta_pct)
+               for kode, nama_produk, price_baru, price_lama, delta, delta_pct
+               in _rows(changed_df, ["kode", "nama_produk", "price_baru", "price_lama", "delta", "delta_pct"])]
+    unchanged = [Product(*row) for row in _rows(result.unchanged, _COLUMNS)]
+    return changed, unchanged
+
+
+# Same conversion as pd.to_numeric(errors="coerce") for a single value
+def _to_number(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and value.isascii() and "_" not in value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return math.nan
+
+
+def _round_pct(value):
+    return round(value * 100) / 100 if math.isfinite(value) else value
+
+
+# Function to compute delta and delta_pct like the vectorized path, None where they are undefined
+# (delta_pct also when the old price is 0)
+def _deltas(new_num, old_num):
+    delta = new_num - old_num
+    if old_num == 0 or math.isnan(delta):
+        pct = math.nan
+    else:
+        pct = _round_pct(delta / old_num * 100)
+    return (None if math.isnan(delta) else delta), (None if not math.isfinite(pct) else pct)
+
+
+# Function to compare one new price with the stored one like detect_price_change does:
+# numbers by value (15000 == "15000"), other values by text. Returns (same, delta, delta_pct).
+def compare_prices(price, price_lama):
+    new_num, old_num = _to_number(price), _to_number(price_lama)
+    if math.isnan(new_num) and math.isnan(old_num):
+        return str(price) == str(price_lama), None, None
+    if new_num == old_num:
+        return True, None, None
+    return (False,) + _deltas(new_num, old_num)
+
+
+# Pure Python version of _detect_price_change for small inputs; returns the same lists
+def _detect_price_change_small(new_data, old_data):
+    new = {}
+    for item in new_data:
+        # Last occurrence wins and decides the position, as with drop_duplicates(keep="last")
+        new.pop(item.get("kode"), None)
+        new[item.get("kode")] = item
+
+    changed, unchanged, errored = [], [], []
+    for kode, item in new.items():
+        price = item.get("price")
+        if price == ERROR_PRICE:
+            errored.append(kode)
+            continue
+        old = old_data.get(kode)
+        if old is None:
+            changed.append(Change(kode, item.get("nama_produk"), price, "N/A"))
+            continue
+        price_lama = old.get("price")
+        same, delta, delta_pct = compare_prices(price, price_lama)
+        if same:
+            unchanged.append(Product(kode, item.get("nama_produk"), price))
+            continue
+        changed.append(Change(kode, item.get("nama_produk"), price, price_lama or "N/A", delta, delta_pct))
+
+    if errored:
+        logging.warning(f"{len(errored)} kode gagal diambil: {errored}")
+    return changed, unchanged
+
+
+# Function to build random (new_data, old_data) snapshots mixing every price shape the upstream and
+# the store produce: ints, floats, numeric text, "N/A", None, 0, failed lookups, new and gone codes
+def _parity_snapshots(rows, rng):
+    prices = [1000, 1500, 0, 2000.5, "1200", "1500", "N/A", None, ERROR_PRICE]
+    old = {f"K{i}": {"kode": f"K{i}", "nama_produk": f"Produk {i}", "price": rng.choice(prices[:-1])}
+           for i in range(rows) if rng.random() < 0.9}
+    new = [{"kode": f"K{i}", "nama_produk": f"Produk {i}", "price": rng.choice(prices)}
+           for i in range(rows + rows // 10) if rng.random() < 0.95]
+    # Snapshots where every stored price is an int, the case where a float column would show up
+    if rng.random() < 0.5:
+        old = {kode: dict(item, price=rng.choice([1000, 1500, 0])) for kode, item in old.items()}
+    return new, old
+
+
+# Function to check that the pure Python and vectorized diffs return the same records (including the
+# Python types of the prices); returns the number of mismatching snapshots
+def check_parity(rounds=20, rows=500, seed=0):
+    import random
+
+    def dump(result):
+        return [[(dict(record), {key: type(value).__name__ for key, value in dict(record).items()})
+                 for record in records] for records in result]
+
+    rng = random.Random(seed)
+    mismatches = 0
+    for i in range(rounds):
+        new, old = _parity_snapshots(rows, rng)
+        small = dump(_detect_price_change_small(new, old))
+        vectorized = dump(_detect_price_change_vectorized(new, old))
+        if small != vectorized:
+            mismatches += 1
+            print(f"Putaran {i}: hasil berbeda")
+            for expected, got in zip(small[0] + small[1], vectorized[0] + vectorized[1]):
+                if expected != got:
+                    print(f"  python:     {expected}\n  vectorized: {got}")
+                    break
+    return mismatches
+
+
+# Parity check of the two diff paths: python3 diff_engine.py --rounds 50 --rows 2000
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare the pure Python and vectorized price diffs")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    failed = check_parity(args.rounds, args.rows, args.seed)
+    print(f"{args.rounds - failed}/{args.rounds} putaran sama")
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,140 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+
+from metrics import registry, Counter
+from exporter import EXPORT_FORMATS, EXPORT_COLUMNS, render_export
+
+# Directory of rendered exports, one file per (snapshot contents, format)
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", "export_cache")
+# Retention: at most this many files, none older than MAX_AGE seconds, at most MAX_BYTES in total
+# (0 disables a limit). Least recently used files go first.
+EXPORT_CACHE_MAX_FILES = int(os.getenv("EXPORT_CACHE_MAX_FILES", "50"))
+EXPORT_CACHE_MAX_AGE = float(os.getenv("EXPORT_CACHE_MAX_AGE", str(7 * 86400)))
+EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+
+EXPORT_CACHE_LOOKUPS = registry.register(Counter(
+    "price_export_cache_lookups_total", "Export cache lookups by result.", labels=("result",)))
+
+
+# Function to hash the exported columns of every row, in order, plus the format
+def export_key(rows, fmt, columns=EXPORT_COLUMNS):
+    digest = hashlib.sha256(f"{fmt}\0{','.join(columns)}\n".encode("utf-8"))
+    for item in rows:
+        digest.update("\0".join(str(item.get(column)) for column in columns).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+# Content-addressed cache of rendered exports. Identical data in the same format is served from disk
+# instead of being rendered again; a hit refreshes the file's mtime, which drives the retention.
+class ExportCache:
+    def __init__(self, path=EXPORT_CACHE_DIR, max_files=EXPORT_CACHE_MAX_FILES, max_age=EXPORT_CACHE_MAX_AGE,
+                 max_bytes=EXPORT_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_files = max_files
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.removed = 0
+
+    def _file(self, key, fmt):
+        return os.path.join(self.path, f"{key}.{EXPORT_FORMATS[fmt][1]}")
+
+    # Function to return the export bytes for rows, rendering (with render(rows, fmt)) only on a miss
+    def get_or_render(self, rows, fmt, render=render_export):
+        path = self._file(export_key(rows, fmt), fmt)
+        try:
+            with open(path, "rb") as file:
+                content = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            content = None
+        if content is not None:
+            with self._lock:
+                self.hits += 1
+            EXPORT_CACHE_LOOKUPS.inc("hit")
+            return content
+
+        with self._lock:
+            self.misses += 1
+        EXPORT_CACHE_LOOKUPS.inc("miss")
+        content = render(rows, fmt)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            # Write under a unique name and rename, so concurrent workers never read a partial file
+            tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(tmp, "wb") as file:
+                file.write(content)
+            os.replace(tmp, path)
+            self.prune()
+        except OSError as e:
+            logging.error(f"Gagal menyimpan export ke cache: {e}")
+        return content
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for entry in os.scandir(self.path):
+            if not entry.is_file() or entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    # Function to apply the retention policy; returns the number of files removed
+    def prune(self, now=None):
+        now = time.time() if now is None else now
+        entries = sorted(self._entries(), reverse=True)  # most recently used first
+        keep_bytes = 0
+        removed = 0
+        for index, (mtime, size, path) in enumerate(entries):
+            keep_bytes += size
+            expired = (
+                (self.max_age and now - mtime > self.max_age)
+                or (self.max_files and index >= self.max_files)
+                # The newest file is always kept, even when it alone exceeds the size limit
+                or (self.max_bytes and index and keep_bytes > self.max_bytes)
+            )
+            if not expired:
+                continue
+            keep_bytes -= size
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            with self._lock:
+                self.removed += removed
+            logging.info(f"{removed} file export lama dihapus dari cache.")
+        return removed
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "removed": self.removed,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "max_files": self.max_files,
+                "max_age": self.max_age,
+                "max_bytes": self.max_bytes,
+            }
+
+
+if __name__ == "__main__":
+    print(f"{ExportCache().prune()} file export dihapus")
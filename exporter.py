@@ -0,0 +1,117 @@
+import io
+import csv
+from datetime import datetime
+from metrics import stage_timer
+
+# Supported export formats: format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+DEFAULT_FORMAT = "xlsx"
+EXPORT_COLUMNS = ["kode", "nama_produk", "price"]
+
+# Rows per chunk for the CSV stream and per row group for Parquet
+CHUNK_ROWS = 1000
+
+
+# Function to validate the format= query parameter
+def parse_format(value):
+    fmt = (value or DEFAULT_FORMAT).lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format tidak didukung: {fmt}. Pilih salah satu: {', '.join(EXPORT_FORMATS)}")
+    return fmt
+
+
+def export_filename(prefix, fmt):
+    return f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{EXPORT_FORMATS[fmt][1]}"
+
+
+# Function to stream rows as CSV text, one chunk of CHUNK_ROWS rows at a time
+def iter_csv(rows, columns=EXPORT_COLUMNS):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for i, item in enumerate(rows, 1):
+        writer.writerow([item.get(column) for column in columns])
+        if i % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Function to render rows into an in-memory XLSX using openpyxl's write-only mode,
+# which streams rows to the archive instead of keeping a cell grid in memory
+def render_xlsx(rows, columns=EXPORT_COLUMNS):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+    sheet.append(columns)
+    for item in rows:
+        sheet.append([item.get(column) for column in columns])
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+# Function to render rows into an in-memory Parquet file, one row group per chunk.
+# Prices are written as text because upstream mixes numbers with "Error"/"N/A".
+def render_parquet(rows, columns=EXPORT_COLUMNS):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(column, pa.string()) for column in columns])
+    output = io.BytesIO()
+    with pq.ParquetWriter(output, schema) as writer:
+        chunk = []
+        for item in rows:
+            chunk.append(item)
+            if len(chunk) == CHUNK_ROWS:
+                writer.write_batch(_parquet_batch(chunk, schema))
+                chunk = []
+        if chunk:
+            writer.write_batch(_parquet_batch(chunk, schema))
+    return output.getvalue()
+
+
+def _parquet_batch(chunk, schema):
+    import pyarrow as pa
+
+    arrays = [pa.array([None if item.get(field.name) is None else str(item.get(field.name))
+                        for item in chunk], type=pa.string())
+              for field in schema]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+# Function to render rows into bytes in the given format (used for Telegram attachments)
+def render_export(rows, fmt=DEFAULT_FORMAT):
+    with stage_timer("export", len(rows)):
+        return _render_export(rows, fmt)
+
+
+def _render_export(rows, fmt):
+    if fmt == "csv":
+        return "".join(iter_csv(rows)).encode("utf-8")
+    if fmt == "parquet":
+        return render_parquet(rows)
+    return render_xlsx(rows)
+
+
+# Function to build the Flask download response without touching the disk.
+# CSV is streamed chunk by chunk; XLSX and Parquet are served from memory, or from the
+# export cache (export_cache.ExportCache) when one is given.
+def export_response(rows, fmt=DEFAULT_FORMAT, prefix="export", cache=None):
+    from flask import Response, send_file, stream_with_context
+
+    mimetype = EXPORT_FORMATS[fmt][0]
+    filename = export_filename(prefix, fmt)
+    if fmt == "csv":
+        response = Response(stream_with_context(iter_csv(rows)), mimetype=mimetype)
+        response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+        return response
+    content = cache.get_or_render(rows, fmt) if cache is not None else render_export(rows, fmt)
+    return send_file(io.BytesIO(content), mimetype=mimetype,
+                     as_attachment=True, download_name=filename)
@@ -0,0 +1,202 @@
+import os
+import math
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import registry, Counter, stage_timer, observe_upstream
+from upstream_guard import upstream_bucket, upstream_breaker
+
+# Default parallelism and per-request timeout (seconds) for upstream lookups
+FETCH_MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", "16"))
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "10"))
+# Largest per-request timeout a ?timeout= parameter may ask for
+FETCH_MAX_TIMEOUT = float(os.getenv("FETCH_MAX_TIMEOUT", "30"))
+# A finished lookup is shared with callers asking for the same code within this many seconds (0 = only in flight)
+SINGLE_FLIGHT_WINDOW = float(os.getenv("SINGLE_FLIGHT_WINDOW", "5"))
+
+COALESCED = registry.register(Counter(
+    "price_upstream_coalesced_total", "Lookups answered by a call already in flight or just finished."))
+
+# Record used when a code could not be fetched
+def error_record(code):
+    return {"kode": code, "nama_produk": "Error", "price": "Error"}
+
+
+# Raised by fetch functions when the upstream itself failed (HTTP 5xx or 429)
+class UpstreamError(Exception):
+    def __init__(self, code, status):
+        super().__init__(f"upstream returned HTTP {status} for {code}")
+        self.status = status
+
+
+# Function to tell whether a status code means the upstream is failing or overloaded
+def is_upstream_status(status):
+    return status == 429 or status >= 500
+
+
+# Only failures of the upstream count toward the circuit breaker; a bad local argument
+# (e.g. ValueError for a negative timeout) must not open it for everyone
+UPSTREAM_FAILURES = (requests.RequestException, UpstreamError)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.finished_at = None
+
+
+# Single-flight: concurrent lookups of the same key wait for one call instead of each calling upstream.
+# Successful results stay shared for `window` seconds; errors and empty results are not reused once finished.
+class SingleFlight:
+    def __init__(self, window=SINGLE_FLIGHT_WINDOW):
+        self.window = window
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._prune_at = 1024
+        self.calls = 0
+        self.shared = 0
+
+    def _reusable(self, call, now):
+        return call.finished_at is None or now - call.finished_at <= self.window
+
+    def do(self, key, func):
+        with self._lock:
+            now = time.monotonic()
+            call = self._calls.get(key)
+            leader = call is None or not self._reusable(call, now)
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                if len(self._calls) > self._prune_at:
+                    self._prune(now)
+            else:
+                self.shared += 1
+        if not leader:
+            COALESCED.inc()
+            call.done.wait()
+            return call.result
+
+        try:
+            call.result = func()
+        finally:
+            call.finished_at = time.monotonic()
+            result = call.result
+            if self.window <= 0 or result is None or result.get("price") == "Error":
+                with self._lock:
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _prune(self, now):
+        for key in [key for key, call in self._calls.items() if not self._reusable(call, now)]:
+            del self._calls[key]
+        self._prune_at = max(1024, 2 * len(self._calls))
+
+    def clear(self):
+        with self._lock:
+            self._calls = {key: call for key, call in self._calls.items() if call.finished_at is None}
+
+    def stats(self):
+        with self._lock:
+            return {"in_window": len(self._calls), "calls": self.calls, "shared": self.shared}
+
+
+# Shared by every handler in the process, so overlapping requests fetch each code once
+single_flight = SingleFlight()
+
+# Function to fetch a single code, turning unexpected exceptions into an error record
+def _fetch_guarded(fetch_one, code, timeout):
+    return single_flight.do((fetch_one, code), lambda: _fetch_observed(fetch_one, code, timeout))
+
+# Calls are rate limited by the token bucket and skipped while the circuit breaker is open.
+# Only upstream failures (network errors, HTTP 5xx/429) are recorded as breaker failures.
+def _fetch_observed(fetch_one, code, timeout):
+    if not upstream_breaker.allow():
+        return error_record(code)
+    failed = None
+    try:
+        upstream_bucket.acquire()
+        start = time.perf_counter()
+        try:
+            item = fetch_one(code, timeout)
+        except UPSTREAM_FAILURES as e:
+            logging.error(f"Upstream error during fetch for code {code}: {e}")
+            item, failed = error_record(code), True
+        except Exception as e:
+            logging.error(f"Exception during fetch for code {code}: {e}")
+            item = error_record(code)
+        else:
+            failed = False
+        result = "empty" if item is None else "error" if item.get("price") == "Error" else "ok"
+        observe_upstream(time.perf_counter() - start, result)
+    finally:
+        # Every call allowed through settles its half open probe slot
+        if failed:
+            upstream_breaker.record_failure()
+        elif failed is False:
+            upstream_breaker.record_success()
+        else:
+            upstream_breaker.release()
+    return item
+
+def _positive(value, kind, name):
+    if value in (None, ""):
+        return None
+    try:
+        value = kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Parameter {name} harus berupa angka")
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError(f"Parameter {name} harus lebih besar dari 0")
+    return value
+
+# Function to read ?concurrency= and ?timeout= of a request as (max_workers, timeout); raises ValueError
+# on values that are not positive numbers. concurrency is capped at FETCH_MAX_WORKERS and timeout at
+# FETCH_MAX_TIMEOUT, so one request cannot hold the fetch workers for as long as the upstream stalls.
+def fetch_options(args):
+    max_workers = _positive(args.get("concurrency"), int, "concurrency")
+    timeout = _positive(args.get("timeout"), float, "timeout")
+    return ((min(max_workers, FETCH_MAX_WORKERS) if max_workers else None),
+            (min(timeout, FETCH_MAX_TIMEOUT) if timeout else None))
+
+# Function to fetch many codes in parallel with bounded concurrency.
+# fetch_one(code, timeout) returns a record dict, or None to skip the code.
+# Results keep the order of the input codes.
+def fetch_concurrently(codes, fetch_one, max_workers=None, timeout=None):
+    codes = list(codes)
+    if not codes:
+        return []
+    max_workers = max_workers or FETCH_MAX_WORKERS
+    timeout = timeout or FETCH_TIMEOUT
+    workers = max(1, min(max_workers, len(codes)))
+    with stage_timer("fetch", len(codes)):
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch") as executor:
+            results = executor.map(lambda code: _fetch_guarded(fetch_one, code, timeout), codes)
+            return [item for item in results if item is not None]
+
+# Function to fetch codes in parallel and yield each record as soon as it arrives (completion order).
+# At most two lookups per worker are queued, so memory stays flat however many codes are passed.
+def iter_concurrently(codes, fetch_one, max_workers=None, timeout=None):
+    max_workers = max(1, max_workers or FETCH_MAX_WORKERS)
+    if hasattr(codes, "__len__"):
+        max_workers = max(1, min(max_workers, len(codes)))
+    timeout = timeout or FETCH_TIMEOUT
+    codes = iter(codes)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch") as executor:
+        pending = set()
+        while True:
+            for code in codes:
+                pending.add(executor.submit(_fetch_guarded, fetch_one, code, timeout))
+                if len(pending) >= max_workers * 2:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = future.result()
+                if item is not None:
+                    yield item
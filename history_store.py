@@ -0,0 +1,338 @@
+import os
+import re
+import time
+import uuid
+import bisect
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process month lock, readers retry when compaction removes a file
+    fcntl = None
+
+from metrics import stage_timer
+
+# Directory of monthly Parquet partitions holding every observed price
+HISTORY_DIR = os.getenv("HISTORY_DIR", "price_history")
+# Small per-cycle files in a month are merged into one sorted file once there are this many
+HISTORY_COMPACT_PARTS = int(os.getenv("HISTORY_COMPACT_PARTS", "96"))
+# Row group size of compacted files; smaller groups let queries skip more data per kode
+HISTORY_ROW_GROUP = int(os.getenv("HISTORY_ROW_GROUP", "16384"))
+# Default query range when from is not given
+HISTORY_DEFAULT_RANGE = float(os.getenv("HISTORY_DEFAULT_RANGE", str(30 * 86400)))
+# Reads of a month are retried this many times when compaction removed a file in between
+_READ_ATTEMPTS = 3
+
+_COMPACTED = "data.parquet"
+_BUCKET_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+# Largest bucket accepted (about 10 years)
+_BUCKET_MAX = 3653 * 86400
+# Query times accepted, in epoch seconds: the month walk and datetime conversions stay within range
+_TIME_MIN = 0.0
+_TIME_MAX = datetime(9999, 1, 1, tzinfo=timezone.utc).timestamp()
+
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([("kode", pa.string()), ("ts", pa.int64()), ("price", pa.float64())])
+
+
+def _month(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m")
+
+
+# Function to parse a bucket like "15m", "1h", "1d" or a number of seconds
+def parse_bucket(value, default="1h"):
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*", value or default)
+    if not match or float(match.group(1)) <= 0:
+        raise ValueError(f"Bucket tidak valid: {value!r} (contoh: 15m, 1h, 1d)")
+    seconds = float(match.group(1)) * _BUCKET_UNITS[match.group(2) or "s"]
+    if seconds > _BUCKET_MAX:
+        raise ValueError(f"Bucket terlalu besar: {value!r} (maksimal {_BUCKET_MAX // 86400}d)")
+    return int(seconds) or 1
+
+
+# Function to parse epoch seconds or an ISO date/datetime (UTC when no offset is given),
+# from 1970 up to the end of 9998; anything else raises ValueError
+def parse_time(value, default=None):
+    if value in (None, ""):
+        return default
+    try:
+        ts = float(value)
+    except ValueError:
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"Waktu tidak valid: {value!r} (gunakan epoch detik atau ISO 8601)")
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        ts = parsed.timestamp()
+    # NaN fails both comparisons, so it is rejected too
+    if not _TIME_MIN <= ts < _TIME_MAX:
+        raise ValueError(f"Waktu di luar jangkauan: {value!r} (antara tahun 1970 dan 9998)")
+    return ts
+
+
+# Append-only columnar price history: one Parquet file per cycle, compacted per month into a
+# file sorted by (kode, ts) so a query for one kode only reads the row groups that contain it
+class HistoryStore:
+    def __init__(self, path=HISTORY_DIR, compact_parts=HISTORY_COMPACT_PARTS, row_group_size=HISTORY_ROW_GROUP):
+        self.path = path
+        self.compact_parts = compact_parts
+        self.row_group_size = row_group_size
+        self._indexes = {}  # compacted file -> ((mtime, size), row group kode mins, maxs)
+        self._lock = threading.Lock()
+
+    def _month_dir(self, month):
+        return os.path.join(self.path, f"month={month}")
+
+    def _files(self, month_dir):
+        if not os.path.isdir(month_dir):
+            return []
+        return sorted(os.path.join(month_dir, name) for name in os.listdir(month_dir) if name.endswith(".parquet"))
+
+    # Function to list a month's files with their (mtime, size), to notice files replaced during a read
+    def _snapshot(self, month_dir):
+        snapshot = []
+        for path in self._files(month_dir):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            snapshot.append((path, (stat.st_mtime_ns, stat.st_size)))
+        return snapshot
+
+    # Function to append one cycle of observed records; non-numeric prices (errors, "N/A") are skipped.
+    # Returns the number of rows written.
+    def append(self, records, observed_at=None):
+        with self.writer(observed_at) as writer:
+            return writer.append(records)
+
+    # Function to open one part file for a whole cycle, so a streamed run can append batch by batch
+    def writer(self, observed_at=None):
+        return HistoryWriter(self, int(time.time() if observed_at is None else observed_at))
+
+    # Function to hold a month's lock file: shared while reading, exclusive while compacting, so a
+    # reader never lists part files that compaction removes before they are read
+    @contextmanager
+    def _month_lock(self, month_dir, exclusive=False):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(month_dir, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    # Function to merge a month's part files into its compacted file, sorted by kode then time.
+    # The exclusive month lock keeps concurrent processes from compacting the same month twice.
+    def compact(self, month):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        month_dir = self._month_dir(month)
+        os.makedirs(month_dir, exist_ok=True)
+        with self._month_lock(month_dir, exclusive=True):
+            files = self._files(month_dir)
+            parts = [path for path in files if os.path.basename(path) != _COMPACTED]
+            if not parts:
+                return 0
+            table = pa.concat_tables([pq.read_table(path, memory_map=True).cast(_schema()) for path in files])
+            table = table.sort_by([("kode", "ascending"), ("ts", "ascending")])
+            tmp = os.path.join(month_dir, f".{_COMPACTED}.{uuid.uuid4().hex[:8]}.tmp")
+            pq.write_table(table, tmp, row_group_size=self.row_group_size, use_dictionary=["kode"])
+            os.replace(tmp, os.path.join(month_dir, _COMPACTED))
+            for path in parts:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:  # already compacted by another process (no month lock)
+                    pass
+        logging.info(f"Riwayat harga {month}: {len(parts)} file digabung, {table.num_rows} baris.")
+        return len(parts)
+
+    def _months(self, start, end):
+        months = []
+        cursor = datetime.fromtimestamp(start, timezone.utc).replace(day=1, hour=0, minute=0, second=0,
+                                                                      microsecond=0)
+        while cursor.timestamp() <= end:
+            months.append(cursor.strftime("%Y-%m"))
+            cursor = cursor.replace(year=cursor.year + cursor.month // 12, month=cursor.month % 12 + 1)
+        return months
+
+    # Function to get the kode range of every row group in a compacted file, cached until it changes
+    def _row_group_index(self, path):
+        import pyarrow.parquet as pq
+
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._indexes.get(path)
+        if cached and cached[0] == key:
+            return cached[1], cached[2]
+        metadata = pq.ParquetFile(path, memory_map=True).metadata
+        column = metadata.schema.to_arrow_schema().get_field_index("kode")
+        mins, maxs = [], []
+        for group in range(metadata.num_row_groups):
+            stats = metadata.row_group(group).column(column).statistics
+            if stats is None or not stats.has_min_max:
+                mins.append("")
+                maxs.append("\U0010ffff")
+            else:
+                mins.append(stats.min)
+                maxs.append(stats.max)
+        with self._lock:
+            self._indexes[path] = (key, mins, maxs)
+        return mins, maxs
+
+    def _read_kode(self, path, kode):
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        if os.path.basename(path) == _COMPACTED:
+            # Sorted by kode: only the row groups whose kode range covers this kode are read
+            mins, maxs = self._row_group_index(path)
+            groups = range(bisect.bisect_left(maxs, kode), bisect.bisect_right(mins, kode))
+            if not groups:
+                return None
+            table = parquet_file.read_row_groups(groups, columns=["kode", "ts", "price"])
+        else:
+            table = parquet_file.read(columns=["kode", "ts", "price"])
+        return table.filter(pc.equal(table["kode"], kode))
+
+    # Function to read the raw (ts, price) samples of one kode within [start, end], sorted by time
+    def samples(self, kode, start, end):
+        import numpy as np
+
+        ts_parts, price_parts = [], []
+        for month in self._months(start, end):
+            month_dir = self._month_dir(month)
+            if not os.path.isdir(month_dir):
+                continue
+            for attempt in range(_READ_ATTEMPTS):
+                try:
+                    with self._month_lock(month_dir):
+                        listed = self._snapshot(month_dir)
+                        tables = [self._read_kode(path, kode) for path, _ in listed]
+                        # Without a month lock compaction may replace or remove the files just read
+                        # (rows counted twice); new part files appearing meanwhile are harmless
+                        if fcntl is not None or set(listed) <= set(self._snapshot(month_dir)):
+                            break
+                except FileNotFoundError:
+                    pass
+                if attempt == _READ_ATTEMPTS - 1:
+                    raise RuntimeError(f"Riwayat harga {month} berubah terus saat dibaca, coba lagi")
+            for table in tables:
+                if table is not None and table.num_rows:
+                    ts_parts.append(table.column("ts").to_numpy())
+                    price_parts.append(table.column("price").to_numpy())
+        if not ts_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        ts = np.concatenate(ts_parts)
+        prices = np.concatenate(price_parts)
+        order = np.argsort(ts, kind="stable")
+        ts, prices = ts[order], prices[order]
+        keep = (ts >= start) & (ts <= end)
+        return ts[keep], prices[keep]
+
+    # Function to downsample one kode into buckets of `bucket` seconds with min/max/last/count
+    def query(self, kode, start, end, bucket):
+        import numpy as np
+
+        with stage_timer("history_query"):
+            ts, prices = self.samples(kode, start, end)
+            if not len(ts):
+                return []
+            keys = ts // bucket * bucket
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            ends = np.r_[starts[1:], len(ts)]
+            return [
+                {"t": int(key), "min": float(low), "max": float(high), "last": float(last), "count": int(count)}
+                for key, low, high, last, count in zip(
+                    keys[starts],
+                    np.minimum.reduceat(prices, starts),
+                    np.maximum.reduceat(prices, starts),
+                    prices[ends - 1],
+                    ends - starts,
+                )
+            ]
+
+
+# Writes one cycle into a single part file (one row group per append) and publishes it on close
+class HistoryWriter:
+    def __init__(self, store, observed_at):
+        self.store = store
+        self.observed_at = observed_at
+        self.month = _month(observed_at)
+        self.rows = 0
+        self._writer = None
+        self._path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, records):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        rows = []
+        for item in records:
+            try:
+                rows.append((item["kode"], float(item.get("price"))))
+            except (TypeError, ValueError):
+                continue
+        if not rows:
+            return 0
+        with stage_timer("history", len(rows)):
+            table = pa.table({
+                "kode": [kode for kode, _ in rows],
+                "ts": [self.observed_at] * len(rows),
+                "price": [price for _, price in rows],
+            }, schema=_schema())
+            if self._writer is None:
+                month_dir = self.store._month_dir(self.month)
+                os.makedirs(month_dir, exist_ok=True)
+                name = f"part-{self.observed_at}-{uuid.uuid4().hex[:8]}.parquet"
+                self._path = os.path.join(month_dir, name)
+                self._writer = pq.ParquetWriter(os.path.join(month_dir, f".{name}.tmp"), _schema())
+            self._writer.write_table(table)
+        self.rows += len(rows)
+        return len(rows)
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        month_dir = os.path.dirname(self._path)
+        os.replace(os.path.join(month_dir, f".{os.path.basename(self._path)}.tmp"), self._path)
+        if len(self.store._files(month_dir)) > self.store.compact_parts:
+            self.store.compact(self.month)
+
+
+# Function to answer /history from the query string; raises ValueError on bad parameters
+def history_response(store, args):
+    kode = (args.get("kode") or "").strip()
+    if not kode:
+        raise ValueError("Parameter kode wajib diisi")
+    end = parse_time(args.get("to"), default=time.time())
+    start = parse_time(args.get("from"), default=end - HISTORY_DEFAULT_RANGE)
+    if start > end:
+        raise ValueError("Parameter from harus sebelum to")
+    bucket = parse_bucket(args.get("bucket"))
+    points = store.query(kode, start, end, bucket)
+    for point in points:
+        point["time"] = datetime.fromtimestamp(point["t"], timezone.utc).isoformat()
+    return {"kode": kode, "from": start, "to": end, "bucket": bucket, "points": points}
+
+
+if __name__ == "__main__":
+    import sys
+    store = HistoryStore()
+    for month in sys.argv[1:] or [_month(time.time())]:
+        print(f"{month}: {store.compact(month)} file digabung")
@@ -0,0 +1,71 @@
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connection pool and timeout settings shared by the tokovoucher and Telegram clients
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+# Archive path for recording every upstream GET with its timing, for replay.py ("{pid}" is replaced
+# by the process id, so each gunicorn worker writes its own file). Empty disables the capture.
+UPSTREAM_CAPTURE = os.getenv("UPSTREAM_CAPTURE", "")
+
+_session = None
+_session_lock = threading.Lock()
+_capture = None
+_capture_lock = threading.Lock()
+
+# Function to build a keep-alive session with a connection pool per host
+def create_session(pool_size=None):
+    pool_size = pool_size or HTTP_POOL_SIZE
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Function to get the process-wide shared session
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+# A bare number is treated as the read timeout, the connect timeout stays short
+def _resolve_timeout(timeout):
+    if timeout is None:
+        return (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    if isinstance(timeout, (int, float)):
+        return (HTTP_CONNECT_TIMEOUT, timeout)
+    return timeout
+
+# Function to get the capture archive writer, opened on the first recorded request
+def get_capture():
+    global _capture
+    if _capture is None:
+        with _capture_lock:
+            if _capture is None:
+                from replay import CaptureWriter
+                _capture = CaptureWriter(UPSTREAM_CAPTURE)
+    return _capture
+
+# GET through the shared pool
+def get(url, timeout=None, **kwargs):
+    if not UPSTREAM_CAPTURE:
+        return get_session().get(url, timeout=_resolve_timeout(timeout), **kwargs)
+    start = time.perf_counter()
+    try:
+        response = get_session().get(url, timeout=_resolve_timeout(timeout), **kwargs)
+    except requests.exceptions.RequestException as e:
+        get_capture().record(url, None, time.perf_counter() - start, error=e)
+        raise
+    get_capture().record(url, response, time.perf_counter() - start)
+    return response
+
+# POST through the shared pool
+def post(url, timeout=None, **kwargs):
+    return get_session().post(url, timeout=_resolve_timeout(timeout), **kwargs)
@@ -0,0 +1,65 @@
+import gc
+import sys
+import json
+import argparse
+import tracemalloc
+
+from mock_upstream import MockConfig, mock_product
+from records import Product, ProductTable
+
+# Record layouts compared: name -> function turning parsed upstream records into a snapshot
+LAYOUTS = {
+    "dict": lambda records: {item["kode"]: item for item in records},
+    "slots": lambda records: {item.kode: item for item in map(Product.of, records)},
+    "table": ProductTable,
+}
+
+
+# Function to produce records the way they arrive from upstream: freshly parsed JSON, so every
+# snapshot gets its own string objects (json.loads does not intern values)
+def iter_upstream(config, codes, epoch, chunk=10000):
+    for start in range(0, len(codes), chunk):
+        payload = json.dumps([mock_product(config, code, epoch) for code in codes[start:start + chunk]])
+        yield from json.loads(payload)
+
+
+# Function to measure the memory held by `snapshots` snapshots of the catalog in one layout
+def measure(layout, config, codes, snapshots):
+    gc.collect()
+    tracemalloc.start()
+    held = [LAYOUTS[layout](iter_upstream(config, codes, epoch)) for epoch in range(snapshots)]
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return {"mb": round(current / 1e6, 1), "peak_mb": round(peak / 1e6, 1),
+            "bytes_per_record": round(current / (len(codes) * snapshots), 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory held by product snapshots per record layout")
+    parser.add_argument("--codes", type=int, default=200000)
+    parser.add_argument("--snapshots", type=int, default=3, help="snapshots held at once (e.g. operators)")
+    parser.add_argument("--layouts", default=",".join(LAYOUTS))
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(catalog_size=args.codes)
+    codes = config.catalog_codes(args.codes)
+    report = {}
+    print(f"{args.codes} kode x {args.snapshots} snapshot")
+    print(f"{'layout':<8}{'MB':>10}{'peak MB':>10}{'bytes/record':>14}")
+    for layout in [name.strip() for name in args.layouts.split(",") if name.strip()]:
+        report[layout] = measure(layout, config, codes, args.snapshots)
+        row = report[layout]
+        print(f"{layout:<8}{row['mb']:>10}{row['peak_mb']:>10}{row['bytes_per_record']:>14}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit(0)
@@ -0,0 +1,185 @@
+import os
+import time
+import random
+import bisect
+import itertools
+import threading
+from contextlib import contextmanager
+
+# Add X-Response-Time / Server-Timing headers to every response (or per request with X-Debug-Timing: 1)
+METRICS_TIMING_HEADER = os.getenv("METRICS_TIMING_HEADER", "0") == "1"
+# Debug logging of payloads: "sample" logs a count plus a few items, "full" logs everything
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "sample")
+LOG_PAYLOAD_SAMPLE = int(os.getenv("LOG_PAYLOAD_SAMPLE", "3"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(names, label_values + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(names, label_values + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+
+# Holds every metric plus collectors, callables returning extra exposition lines at scrape time
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "price_pipeline_stage_seconds", "Duration of one pipeline stage call.", labels=("stage",)))
+STAGE_ITEMS = registry.register(Counter(
+    "price_pipeline_stage_items_total", "Items processed per pipeline stage.", labels=("stage",)))
+UPSTREAM_SECONDS = registry.register(Histogram(
+    "price_upstream_request_seconds", "Latency of one upstream product lookup.", labels=("result",)))
+HTTP_SECONDS = registry.register(Histogram(
+    "price_http_request_seconds", "Flask request duration.", labels=("endpoint", "status")))
+
+# Per-request stage timings, used for the Server-Timing header
+_request_timings = threading.local()
+
+
+def _record_stage(stage, elapsed, items=None):
+    STAGE_SECONDS.observe(elapsed, stage)
+    if items is not None:
+        STAGE_ITEMS.inc(stage, amount=items)
+    timings = getattr(_request_timings, "stages", None)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def stage_timer(stage, items=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_stage(stage, time.perf_counter() - start, items)
+
+
+def observe_upstream(elapsed, result):
+    UPSTREAM_SECONDS.observe(elapsed, result)
+
+
+# Function to describe a payload for debug logs without dumping all of it
+def summarize(data):
+    if LOG_PAYLOADS == "full":
+        return repr(data)
+    if isinstance(data, dict):
+        size, sample = len(data), list(itertools.islice(data.values(), LOG_PAYLOAD_SAMPLE))
+    elif isinstance(data, (list, tuple)):
+        size = len(data)
+        sample = random.sample(data, LOG_PAYLOAD_SAMPLE) if size > LOG_PAYLOAD_SAMPLE else list(data)
+    else:
+        return repr(data)
+    return f"{size} item, contoh: {sample}"
+
+
+# Function to add /metrics and request timing to a Flask app
+def install_metrics(app):
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        _request_timings.stages = {}
+
+    @app.after_request
+    def _finish_timer(response):
+        start = getattr(g, "metrics_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        HTTP_SECONDS.observe(elapsed, request.endpoint or "unknown", response.status_code)
+        stages = getattr(_request_timings, "stages", None) or {}
+        _request_timings.stages = None
+        if METRICS_TIMING_HEADER or request.headers.get("X-Debug-Timing") == "1":
+            response.headers["X-Response-Time"] = f"{elapsed * 1000:.1f}ms"
+            response.headers["Server-Timing"] = ", ".join(
+                [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages.items()]
+                + [f"total;dur={elapsed * 1000:.1f}"])
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    return app
@@ -0,0 +1,198 @@
+import json
+import time
+import random
+import zlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Telegram rejects messages longer than this
+TELEGRAM_MAX_MESSAGE = 4096
+
+
+# Settings of the simulated upstream; prices of changing products move once per epoch.
+# A non-zero price_seed shifts every price by a per-code amount, so several simulators act as
+# suppliers quoting different prices for the same catalog.
+class MockConfig:
+    def __init__(self, catalog_size=1000, latency=0.02, latency_jitter=0.01, error_rate=0.0,
+                 rate_limit_rate=0.0, change_rate=0.05, epoch_seconds=60.0, code_prefix="SIM", price_seed=0):
+        self.catalog_size = catalog_size
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.change_rate = change_rate
+        self.epoch_seconds = epoch_seconds
+        self.code_prefix = code_prefix
+        self.price_seed = price_seed
+
+    def catalog_codes(self, count=None):
+        count = self.catalog_size if count is None else count
+        return [f"{self.code_prefix}{i:06d}" for i in range(count)]
+
+
+# Deterministic product for a catalog code, or None if the code is not in the catalog
+def mock_product(config, code, epoch=None):
+    if not code.startswith(config.code_prefix):
+        return None
+    try:
+        index = int(code[len(config.code_prefix):])
+    except ValueError:
+        return None
+    if index >= config.catalog_size:
+        return None
+    epoch = int(time.time() // config.epoch_seconds) if epoch is None else epoch
+    seed = zlib.crc32(code.encode())
+    price = 1000 + (seed % 500) * 100
+    # A stable subset of products moves price every epoch
+    if (seed % 10000) < config.change_rate * 10000:
+        price += (epoch % 7) * 100
+    if config.price_seed:
+        price += (zlib.crc32(f"{config.price_seed}:{code}".encode()) % 11 - 5) * 50
+    return {"kode": code, "nama_produk": f"Diamond {seed % 5000} ({code})", "price": price}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockUpstream/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self):
+        config = self.server.config
+        if config.latency or config.latency_jitter:
+            time.sleep(max(0.0, random.gauss(config.latency, config.latency_jitter)))
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            self.server.count("429")
+            self._send_json(429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 1}},
+                            {"Retry-After": "1"})
+            return False
+        if roll < config.rate_limit_rate + config.error_rate:
+            self.server.count("5xx")
+            self._send_json(500, {"status": 0, "error_msg": "simulated upstream error"})
+            return False
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/_stats":
+            self._send_json(200, self.server.snapshot_stats())
+            return
+        if url.path != "/produk/code":
+            self._send_json(404, {"error": "not found"})
+            return
+        self.server.count("product_requests")
+        if not self._simulate():
+            return
+        code = parse_qs(url.query).get("kode", [""])[0]
+        product = mock_product(self.server.config, code)
+        self._send_json(200, {"status": 1, "data": [product] if product else []})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        method = urlparse(self.path).path.rsplit("/", 1)[-1]
+        if method not in ("sendMessage", "sendDocument"):
+            self._send_json(404, {"ok": False, "description": "Not Found"})
+            return
+        self.server.count(method)
+        if not self._simulate():
+            return
+        if method == "sendMessage":
+            text = parse_qs(body.decode("utf-8", "replace")).get("text", [""])[0]
+            if len(text) > TELEGRAM_MAX_MESSAGE:
+                self.server.count("message_too_long")
+                self._send_json(400, {"ok": False, "error_code": 400,
+                                      "description": "Bad Request: message is too long"})
+                return
+        else:
+            self.server.count("document_bytes", length)
+        self._send_json(200, {"ok": True, "result": {"message_id": self.server.count("delivered")}})
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512
+
+    def __init__(self, address, config):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] = self._stats.get(name, 0) + amount
+            return self._stats[name]
+
+    def snapshot_stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+# Function to start the simulator on a background thread (port 0 picks a free port)
+def start_mock_server(config=None, host="127.0.0.1", port=0):
+    server = MockServer((host, port), config or MockConfig())
+    thread = threading.Thread(target=server.serve_forever, name="mock-upstream", daemon=True)
+    thread.start()
+    return server
+
+
+# Environment for pointing ML.py, check_price.py, app.py and price_monitor.py at the simulator
+def mock_environment(server):
+    return {
+        "TOKOVOUCHER_BASE_URL": f"{server.base_url}/produk/code",
+        "TELEGRAM_API_URL": server.base_url,
+        "MEMBER_CODE": "mock",
+        "SIGNATURE": "mock",
+        "TELEGRAM_TOKEN": "mock-token",
+        "TELEGRAM_CHAT_ID": "1",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for api.tokovoucher.net and api.telegram.org")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--catalog-size", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.02, help="mean latency in seconds")
+    parser.add_argument("--latency-jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 500 responses")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of 429 responses")
+    parser.add_argument("--change-rate", type=float, default=0.05, help="fraction of products whose price moves")
+    parser.add_argument("--epoch-seconds", type=float, default=60.0)
+    parser.add_argument("--price-seed", type=int, default=0, help="shift prices per code (simulate another supplier)")
+    args = parser.parse_args()
+
+    config = MockConfig(args.catalog_size, args.latency, args.latency_jitter, args.error_rate,
+                        args.rate_limit_rate, args.change_rate, args.epoch_seconds, price_seed=args.price_seed)
+    server = MockServer((args.host, args.port), config)
+    print(f"Mock upstream berjalan di {server.base_url}")
+    for name, value in mock_environment(server).items():
+        print(f"  export {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
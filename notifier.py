@@ -0,0 +1,197 @@
+import os
+import html
+import time
+import queue
+import logging
+import threading
+from metrics import stage_timer
+
+# Telegram limits: max characters per message, per-chat and global send rates
+TELEGRAM_MAX_MESSAGE = 4096
+TELEGRAM_PER_CHAT_INTERVAL = float(os.getenv("TELEGRAM_PER_CHAT_INTERVAL", "1.0"))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+
+# How unchanged products are reported: "full" lists them, "summary" only counts them, "none" skips them
+TELEGRAM_UNCHANGED_MODE = os.getenv("TELEGRAM_UNCHANGED_MODE", "summary")
+
+# Room kept free in every message for the "(2/5)" part counter
+_COUNTER_RESERVE = 16
+
+
+# Function to escape one field for Telegram HTML, cutting the raw value to max_field characters first
+# so an entity or tag is never cut in half
+def _field(value, max_field=None):
+    value = str(value)
+    if max_field is not None and len(value) > max_field:
+        value = value[:max_field] + "…"
+    return html.escape(value)
+
+
+def render_change(item, max_field=None):
+    return (f"- Kode: <b>{_field(item['kode'], max_field)}</b>\n"
+            f"  Nama: {_field(item['nama_produk'], max_field)}\n"
+            f"  Harga Lama: <s>{_field(item['price_lama'], max_field)}</s>\n"
+            f"  Harga Baru: <b>{_field(item['price_baru'], max_field)}</b>\n\n")
+
+
+def render_unchanged(item, max_field=None):
+    return (f"- Kode: <b>{_field(item['kode'], max_field)}</b>\n"
+            f"  Nama: {_field(item['nama_produk'], max_field)}\n"
+            f"  Harga: <b>{_field(item['price'], max_field)}</b>\n\n")
+
+
+# Function to render the items of a section, each within one message next to its header: an
+# oversize item is rendered again with its field values cut shorter until it fits
+def _render_parts(render, items, header, limit):
+    room = limit - _COUNTER_RESERVE - len(header)
+    parts = []
+    for item in items:
+        part, max_field = render(item), room
+        while len(part) > room and max_field > 1:
+            part, max_field = render(item, max_field), max_field // 2
+        parts.append(part)
+    return parts
+
+
+# Function to pack rendered parts into messages, splitting only between items (see _render_parts
+# for items that would not fit a message on their own).
+# A section header is repeated at the top of each message that continues its section.
+def _pack(sections, limit):
+    budget = limit - _COUNTER_RESERVE
+    messages = []
+    current = []
+    size = 0
+    for header, parts in sections:
+        current_header = None
+        for part in parts:
+            if size + len(part) + (0 if current_header == header else len(header)) > budget:
+                messages.append("".join(current))
+                current, size, current_header = [], 0, None
+            if current_header != header:
+                current.append(header)
+                size += len(header)
+                current_header = header
+            current.append(part)
+            size += len(part)
+    if current:
+        messages.append("".join(current))
+    return messages
+
+
+# Function to build the Telegram messages for a diff, each one within the size limit
+def build_messages(changed, unchanged=None, unchanged_mode=None, limit=TELEGRAM_MAX_MESSAGE):
+    unchanged = unchanged or []
+    unchanged_mode = unchanged_mode or TELEGRAM_UNCHANGED_MODE
+    sections = []
+    if changed:
+        header = "<b>Perubahan Harga Terdeteksi:</b>\n"
+        sections.append((header, _render_parts(render_change, changed, header, limit)))
+    else:
+        sections.append(("<b>Tidak Ada Perubahan Harga</b>\n", []))
+
+    if unchanged and unchanged_mode == "full":
+        header = "<b>Produk Tanpa Perubahan Harga:</b>\n"
+        sections.append((header, _render_parts(render_unchanged, unchanged, header, limit)))
+    elif unchanged and unchanged_mode == "summary":
+        sections.append((f"<b>Produk Tanpa Perubahan Harga:</b> {len(unchanged)} produk\n", []))
+
+    # Sections without items still need their header in the output
+    sections = [(header, parts or [""]) for header, parts in sections]
+    messages = _pack(sections, limit)
+    if len(messages) > 1:
+        messages = [f"({i}/{len(messages)}) {message}" for i, message in enumerate(messages, 1)]
+    return messages
+
+
+# Function to build the closing message of a streamed run, whose changes were already sent in batches.
+# unchanged is a count, or the unchanged records when unchanged_mode is "full".
+def build_summary(changed_count, unchanged, unchanged_mode=None, limit=TELEGRAM_MAX_MESSAGE):
+    unchanged_mode = unchanged_mode or TELEGRAM_UNCHANGED_MODE
+    unchanged_count = unchanged if isinstance(unchanged, int) else len(unchanged)
+    if changed_count:
+        header = f"<b>Pengecekan Selesai:</b> {changed_count} perubahan harga\n"
+    else:
+        header = "<b>Tidak Ada Perubahan Harga</b>\n"
+    sections = [(header, [""])]
+    if unchanged_count and unchanged_mode == "full" and not isinstance(unchanged, int):
+        full_header = "<b>Produk Tanpa Perubahan Harga:</b>\n"
+        sections.append((full_header, _render_parts(render_unchanged, unchanged, full_header, limit)))
+    elif unchanged_count and unchanged_mode in ("summary", "full"):
+        sections.append((f"<b>Produk Tanpa Perubahan Harga:</b> {unchanged_count} produk\n", [""]))
+    elif changed_count:
+        return []
+    messages = _pack(sections, limit)
+    if len(messages) > 1:
+        messages = [f"({i}/{len(messages)}) {message}" for i, message in enumerate(messages, 1)]
+    return messages
+
+
+# Spacing rule shared by the send queue and the outbox worker: at least per_chat_interval
+# between messages to the same chat and at most global_rate messages per second overall
+class RateLimiter:
+    def __init__(self, per_chat_interval=TELEGRAM_PER_CHAT_INTERVAL, global_rate=TELEGRAM_GLOBAL_RATE):
+        self.per_chat_interval = per_chat_interval
+        self.global_interval = 1.0 / global_rate if global_rate else 0.0
+        self._last_sent = {}
+        self._last_global = 0.0
+        self._lock = threading.Lock()
+
+    # Function to block until chat_id may receive the next message
+    def wait_turn(self, chat_id):
+        with self._lock:
+            now = time.monotonic()
+            ready_at = max(self._last_sent.get(chat_id, 0.0) + self.per_chat_interval,
+                           self._last_global + self.global_interval)
+            if ready_at > now:
+                time.sleep(ready_at - now)
+            now = time.monotonic()
+            self._last_sent[chat_id] = now
+            self._last_global = now
+
+
+# Rate-limited send queue: one worker thread sends in FIFO order through a RateLimiter.
+# send_fn(chat_id, text) does the actual send.
+class NotificationQueue:
+    def __init__(self, send_fn, per_chat_interval=TELEGRAM_PER_CHAT_INTERVAL, global_rate=TELEGRAM_GLOBAL_RATE):
+        self.send_fn = send_fn
+        self.limiter = RateLimiter(per_chat_interval, global_rate)
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+
+    def put(self, chat_id, text):
+        self._ensure_worker()
+        self._queue.put((chat_id, text))
+
+    def put_many(self, chat_id, messages):
+        for text in messages:
+            self.put(chat_id, text)
+
+    # Function to block until every queued message was handled (for CLI runs)
+    def join(self):
+        self._queue.join()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="telegram-queue", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            chat_id, text = self._queue.get()
+            try:
+                self.limiter.wait_turn(chat_id)
+                with stage_timer("telegram", 1):
+                    self.send_fn(chat_id, text)
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"Gagal mengirim notifikasi dari antrian: {e}")
+            finally:
+                self._queue.task_done()
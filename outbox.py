@@ -0,0 +1,241 @@
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+
+from notifier import RateLimiter
+from metrics import stage_timer
+
+# SQLite file holding notifications that still have to reach Telegram
+OUTBOX_DB_FILE = os.getenv("OUTBOX_DB_FILE", "outbox.db")
+# Retry policy: exponential backoff from OUTBOX_BACKOFF_BASE up to OUTBOX_BACKOFF_MAX seconds
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+# An identical notification is not stored again while the first one is still pending or being sent.
+# A window > 0 also drops identical notifications created within that many seconds; it is off by
+# default, because a real alert may repeat (a price going A -> B -> A -> B within an hour).
+OUTBOX_DEDUP_WINDOW = float(os.getenv("OUTBOX_DEDUP_WINDOW", "0"))
+# How long a CLI run waits for pending notifications before exiting
+OUTBOX_DRAIN_TIMEOUT = float(os.getenv("OUTBOX_DRAIN_TIMEOUT", "120"))
+# A record claimed longer ago than this (worker died mid-send) is picked up again
+OUTBOX_CLAIM_TIMEOUT = float(os.getenv("OUTBOX_CLAIM_TIMEOUT", "300"))
+# Retention: sent records are deleted once older than OUTBOX_DEDUP_WINDOW (they only serve dedup),
+# failed ones (which keep their payload) after OUTBOX_FAILED_RETENTION seconds. The worker prunes at
+# most every OUTBOX_PRUNE_INTERVAL seconds.
+OUTBOX_FAILED_RETENTION = float(os.getenv("OUTBOX_FAILED_RETENTION", str(7 * 86400)))
+OUTBOX_PRUNE_INTERVAL = float(os.getenv("OUTBOX_PRUNE_INTERVAL", "300"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    chat_id TEXT,
+    text TEXT,
+    filename TEXT,
+    content BLOB,
+    dedup_key TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_at REAL,
+    created_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_outbox_dedup ON outbox (dedup_key, created_at);
+"""
+
+
+def content_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+# Persistent notification outbox. Handlers only insert records; a background worker
+# delivers them with exponential backoff.
+# send_message(chat_id, text) and send_document(chat_id, filename, content, caption)
+# must return True on success.
+class Outbox:
+    def __init__(self, send_message, send_document=None, path=OUTBOX_DB_FILE, limiter=None,
+                 poll_interval=1.0):
+        self.send_message = send_message
+        self.send_document = send_document
+        self.path = path
+        self.limiter = limiter or RateLimiter()
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._pruned_at = 0.0
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # Function to store a record unless an identical one is still pending or being sent (or, with
+    # OUTBOX_DEDUP_WINDOW, was created recently). Returns the new record id, or None when deduplicated.
+    def _add(self, kind, chat_id, text=None, filename=None, content=None, dedup_key=None):
+        now = time.time()
+        dedup_key = dedup_key or content_key(kind, chat_id, text, content or b"")
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if OUTBOX_DEDUP_WINDOW > 0:
+                duplicate = conn.execute(
+                    "SELECT 1 FROM outbox WHERE dedup_key = ? AND (status IN ('pending', 'sending') OR created_at > ?) LIMIT 1",
+                    (dedup_key, now - OUTBOX_DEDUP_WINDOW),
+                ).fetchone()
+            else:
+                duplicate = conn.execute(
+                    "SELECT 1 FROM outbox WHERE dedup_key = ? AND status IN ('pending', 'sending') LIMIT 1",
+                    (dedup_key,),
+                ).fetchone()
+            record_id = None
+            if not duplicate:
+                record_id = conn.execute(
+                    "INSERT INTO outbox (kind, chat_id, text, filename, content, dedup_key, next_attempt_at, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (kind, str(chat_id), text, filename, content, dedup_key, now, now),
+                ).lastrowid
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if record_id is None:
+            logging.info(f"Notifikasi duplikat diabaikan ({dedup_key[:12]}).")
+        else:
+            self.start()
+            self._wake.set()
+        return record_id
+
+    def add_message(self, chat_id, text, dedup_key=None):
+        return self._add("message", chat_id, text=text, dedup_key=dedup_key)
+
+    def add_messages(self, chat_id, messages):
+        return [self.add_message(chat_id, text) for text in messages]
+
+    # dedup_key should describe the data, since rendered files embed timestamps
+    def add_document(self, chat_id, filename, content, caption, dedup_key=None):
+        return self._add("document", chat_id, text=caption, filename=filename, content=content,
+                         dedup_key=dedup_key)
+
+    # Function to claim the oldest due record so no other worker or process sends it too
+    def _claim(self):
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, kind, chat_id, text, filename, content, attempts FROM outbox "
+                "WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'sending' AND claimed_at < ?) "
+                "ORDER BY id LIMIT 1",
+                (now, now - OUTBOX_CLAIM_TIMEOUT),
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id = ?", (now, row[0]))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _deliver(self, row):
+        record_id, kind, chat_id, text, filename, content, attempts = row
+        self.limiter.wait_turn(chat_id)
+        try:
+            with stage_timer("telegram", 1):
+                if kind == "document":
+                    ok = self.send_document(chat_id, filename, content, text)
+                else:
+                    ok = self.send_message(chat_id, text)
+            error = None if ok else "send returned failure"
+        except Exception as e:
+            ok, error = False, str(e)
+
+        conn = self._connect()
+        attempts += 1
+        if ok:
+            # The payload is no longer needed once delivered; the row is kept for deduplication until pruned
+            conn.execute("UPDATE outbox SET status = 'sent', attempts = ?, content = NULL, last_error = NULL "
+                         "WHERE id = ?", (attempts, record_id))
+        elif attempts >= OUTBOX_MAX_ATTEMPTS:
+            logging.error(f"Notifikasi {record_id} gagal setelah {attempts} percobaan: {error}")
+            conn.execute("UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                         (attempts, error, record_id))
+        else:
+            delay = min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+            logging.warning(f"Notifikasi {record_id} gagal ({error}), dicoba lagi dalam {delay} detik.")
+            conn.execute("UPDATE outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, last_error = ? "
+                         "WHERE id = ?", (attempts, time.time() + delay, error, record_id))
+        return ok
+
+    # Function to send every record that is due right now; returns the number handled
+    def process_due(self):
+        handled = 0
+        while True:
+            row = self._claim()
+            if row is None:
+                return handled
+            self._deliver(row)
+            handled += 1
+
+    # Function to delete sent records past the dedup window and failed ones past OUTBOX_FAILED_RETENTION;
+    # returns the number of deleted records
+    def prune(self, now=None):
+        now = time.time() if now is None else now
+        deleted = self._connect().execute(
+            "DELETE FROM outbox WHERE (status = 'sent' AND created_at < ?) OR (status = 'failed' AND created_at < ?)",
+            (now - OUTBOX_DEDUP_WINDOW, now - OUTBOX_FAILED_RETENTION),
+        ).rowcount
+        if deleted:
+            logging.info(f"Outbox: {deleted} notifikasi lama dihapus.")
+        return deleted
+
+    def _maybe_prune(self):
+        if time.monotonic() - self._pruned_at >= OUTBOX_PRUNE_INTERVAL:
+            self._pruned_at = time.monotonic()
+            self.prune()
+
+    # Function to wait until nothing is pending any more or the timeout passes (for CLI runs)
+    def drain(self, timeout=OUTBOX_DRAIN_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.process_due()
+            if not self.stats().get("pending", 0) and not self.stats().get("sending", 0):
+                self._maybe_prune()
+                return True
+            time.sleep(self.poll_interval)
+        return False
+
+    def _run(self):
+        while True:
+            try:
+                self.process_due()
+                self._maybe_prune()
+            except Exception as e:
+                logging.error(f"Outbox worker error: {e}", exc_info=True)
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def start(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="outbox-worker", daemon=True)
+                self._worker.start()
+
+    def stats(self):
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return dict(rows)
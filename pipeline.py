@@ -0,0 +1,143 @@
+import os
+import time
+import hashlib
+import logging
+from contextlib import nullcontext
+
+from diff_engine import detect_price_change
+from poll_planner import poll_outcome
+from records import ProductTable
+
+# Records are diffed, saved and notified in micro-batches of this many records,
+# or earlier once PIPELINE_BATCH_SECONDS have passed since the batch started
+PIPELINE_BATCH_SIZE = int(os.getenv("PIPELINE_BATCH_SIZE", "200"))
+PIPELINE_BATCH_SECONDS = float(os.getenv("PIPELINE_BATCH_SECONDS", "2"))
+
+
+# Outcome of one streamed run. Only counters are kept, unless the caller asks for the records
+# (exports, kept in a compact ProductTable) or the unchanged items (TELEGRAM_UNCHANGED_MODE=full).
+class PipelineResult:
+    def __init__(self, collect=False, keep_unchanged=False):
+        self.started = time.perf_counter()
+        self.fetched = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.errored = 0
+        self.skipped = 0
+        self.batches = 0
+        self.first_change_seconds = None
+        self.duration = None
+        self.records = ProductTable() if collect else None
+        self.unchanged_items = [] if keep_unchanged else None
+        self._changes = hashlib.sha256()
+
+    def _add(self, batch, changed, unchanged):
+        self.batches += 1
+        self.fetched += len(batch)
+        self.changed += len(changed)
+        self.unchanged += len(unchanged)
+        self.errored += sum(1 for item in batch if item.get("price") == "Error")
+        if changed and self.first_change_seconds is None:
+            self.first_change_seconds = round(time.perf_counter() - self.started, 3)
+        for item in changed:
+            self._changes.update(f"{item['kode']}\0{item['price_lama']}\0{item['price_baru']}\0".encode("utf-8"))
+        if self.unchanged_items is not None:
+            self.unchanged_items.extend(unchanged)
+
+    # Stable key of every change in the run, used to deduplicate the export document
+    def change_key(self):
+        return self._changes.hexdigest()
+
+    def counts(self):
+        return {"fetched": self.fetched, "changed": self.changed, "unchanged": self.unchanged,
+                "errored": self.errored, "skipped": self.skipped, "batches": self.batches,
+                "first_change_seconds": self.first_change_seconds, "seconds": self.duration}
+
+
+# Function to group a record stream into lists of up to `size` records, closing a batch early
+# once `seconds` have passed so slow upstreams still produce alerts
+def micro_batches(stream, size=PIPELINE_BATCH_SIZE, seconds=PIPELINE_BATCH_SECONDS):
+    batch = []
+    deadline = time.monotonic() + seconds
+    for item in stream:
+        batch.append(item)
+        if len(batch) >= size or time.monotonic() >= deadline:
+            yield batch
+            batch = []
+            deadline = time.monotonic() + seconds
+    if batch:
+        yield batch
+
+
+# Shared fetch -> diff -> save -> notify loop of ML.py, check_price.py and price_monitor.py.
+# Each micro-batch is diffed against the stored baseline and saved in one transaction (lock), then
+# its changes are handed to on_changes right away, so the first alert does not wait for the whole
+# catalog and memory stays flat.
+#   stream(codes)  yields fetched records for the given codes, in any order
+#   load(codes)    returns the stored baseline as kode -> record
+#   save(records)  stores records (error records are skipped by the store)
+#   lock()         context manager holding the baseline write lock across load + save
+#   planner        optional PollPlanner deciding which codes are due; the rest keep their stored price
+#   history        optional HistoryStore receiving every record fetched from upstream in this run
+#   from_cache     optional set the stream fills with the codes it answered from a cache; those records
+#                  are not new observations: they are exported and counted as unchanged, but never diffed,
+#                  saved, recorded by the planner or written to history
+def run_pipeline(codes, stream, load, save, lock=None, diff=detect_price_change, planner=None, history=None,
+                 on_changes=None, fresh=False, collect=False, keep_unchanged=False, from_cache=None,
+                 batch_size=PIPELINE_BATCH_SIZE, batch_seconds=PIPELINE_BATCH_SECONDS):
+    codes = list(dict.fromkeys(code for code in codes if code))
+    result = PipelineResult(collect, keep_unchanged)
+    lock = lock or nullcontext
+
+    due = codes
+    if planner is not None and not fresh:
+        due = planner.due(codes, load(codes).keys())
+    due_set = set(due)
+    skipped = [code for code in codes if code not in due_set]
+    result.skipped = len(skipped)
+
+    seen = set()
+    # One history part file per run, however many batches it takes
+    with history.writer() if history is not None else nullcontext() as history_writer:
+        for batch in micro_batches(stream(due), batch_size, batch_seconds):
+            seen.update(item["kode"] for item in batch)
+            cached = [item for item in batch if item["kode"] in from_cache] if from_cache else []
+            observed = [item for item in batch if item["kode"] not in from_cache] if from_cache else batch
+            observed_codes = [item["kode"] for item in observed]
+            changed, unchanged = [], []
+            if observed:
+                with lock():
+                    changed, unchanged = diff(observed, load(observed_codes))
+                    save({item["kode"]: item for item in observed})
+            # Alerts go out first; bookkeeping (and the first pyarrow import) must not delay them
+            result._add(batch, changed, unchanged + cached)
+            if changed and on_changes is not None:
+                on_changes(changed)
+            if planner is not None and observed:
+                planner.record(observed_codes, *poll_outcome(observed, changed))
+            if history_writer is not None and observed:
+                history_writer.append(observed)
+            if result.records is not None:
+                result.records.extend(batch)
+
+    # Due codes the upstream did not return count as checked and unchanged for the planner
+    if planner is not None:
+        not_returned = [code for code in due if code not in seen]
+        if not_returned:
+            planner.record(not_returned)
+
+    # Skipped codes keep their stored price; they only count as unchanged
+    result.unchanged += len(skipped)
+    if skipped and (result.records is not None or result.unchanged_items is not None):
+        stored = load(skipped)
+        if result.records is not None:
+            result.records.extend(stored.values())
+        if result.unchanged_items is not None:
+            result.unchanged_items.extend(stored.values())
+    if result.records is not None:
+        position = {code: index for index, code in enumerate(codes)}
+        result.records.sort(key=lambda item: position.get(item["kode"], len(position)))
+
+    result.duration = round(time.perf_counter() - result.started, 3)
+    logging.info(f"Pipeline selesai: {result.counts()}")
+    return result
@@ -0,0 +1,137 @@
+import os
+import time
+import sqlite3
+import threading
+
+from price_store import PRICE_DB_FILE
+
+# Adaptive polling: a code whose price just changed is checked every POLL_MIN_INTERVAL seconds,
+# every unchanged check multiplies its interval by POLL_BACKOFF, up to POLL_MAX_STALENESS
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", os.getenv("SCHEDULE_INTERVAL", "900")))
+POLL_MAX_STALENESS = float(os.getenv("POLL_MAX_STALENESS", "86400"))
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", "2"))
+# Codes due within this many seconds are polled in the current cycle (absorbs scheduler jitter)
+POLL_DUE_SLACK = float(os.getenv("POLL_DUE_SLACK", "120"))
+# Set to 0 to fetch every code on every run, as before
+POLL_ADAPTIVE = os.getenv("POLL_ADAPTIVE", "1") == "1"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS poll_state (
+    kode TEXT PRIMARY KEY,
+    interval REAL NOT NULL,
+    next_due REAL NOT NULL,
+    last_checked REAL NOT NULL,
+    last_changed REAL,
+    checks INTEGER NOT NULL DEFAULT 0,
+    changes INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Max number of bound parameters per IN (...) query
+_CHUNK_SIZE = 500
+
+
+# Decides per cycle which codes have to be fetched, based on how often each price changed
+class PollPlanner:
+    def __init__(self, path=PRICE_DB_FILE, min_interval=POLL_MIN_INTERVAL, max_staleness=POLL_MAX_STALENESS,
+                 backoff=POLL_BACKOFF, slack=POLL_DUE_SLACK, enabled=POLL_ADAPTIVE):
+        self.path = path
+        self.min_interval = min_interval
+        self.max_staleness = max(max_staleness, min_interval)
+        self.backoff = backoff
+        self.slack = slack
+        self.enabled = enabled
+        self._local = threading.local()
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _states(self, codes):
+        conn = self._connect()
+        states = {}
+        for i in range(0, len(codes), _CHUNK_SIZE):
+            chunk = codes[i:i + _CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            for kode, interval, next_due in conn.execute(
+                    f"SELECT kode, interval, next_due FROM poll_state WHERE kode IN ({placeholders})", chunk):
+                states[kode] = (interval, next_due)
+        return states
+
+    # Function to pick the codes to fetch this cycle, keeping the input order.
+    # Codes never polled before, or without a stored price in known, are always due.
+    def due(self, codes, known=None, now=None):
+        codes = list(dict.fromkeys(codes))
+        if not self.enabled:
+            return codes
+        now = time.time() if now is None else now
+        states = self._states(codes)
+        return [code for code in codes
+                if code not in states
+                or (known is not None and code not in known)
+                or states[code][1] <= now + self.slack]
+
+    # Function to record the outcome of one cycle: changed codes drop back to the minimum
+    # interval, unchanged ones back off, errored ones are retried after the minimum interval
+    def record(self, checked, changed=(), errored=(), now=None):
+        now = time.time() if now is None else now
+        checked = list(dict.fromkeys(checked))
+        changed = set(changed)
+        errored = set(errored)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            states = self._states(checked)
+            rows = []
+            for code in checked:
+                interval = states.get(code, (self.min_interval, None))[0]
+                if code in errored:
+                    rows.append((code, interval, now + self.min_interval, now, 0))
+                    continue
+                if code in changed or code not in states:
+                    interval = self.min_interval
+                else:
+                    interval = min(interval * self.backoff, self.max_staleness)
+                rows.append((code, interval, now + interval, now, 1 if code in changed else 0))
+            conn.executemany(
+                "INSERT INTO poll_state (kode, interval, next_due, last_checked, last_changed, checks, changes) "
+                "VALUES (?1, ?2, ?3, ?4, CASE WHEN ?5 THEN ?4 END, 1, ?5) "
+                "ON CONFLICT(kode) DO UPDATE SET interval = excluded.interval, next_due = excluded.next_due, "
+                "last_checked = excluded.last_checked, "
+                "last_changed = COALESCE(excluded.last_changed, poll_state.last_changed), "
+                "checks = poll_state.checks + 1, changes = poll_state.changes + excluded.changes",
+                rows,
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def stats(self, now=None):
+        now = time.time() if now is None else now
+        row = self._connect().execute(
+            "SELECT COUNT(*), SUM(next_due <= ?), MIN(interval), MAX(interval), AVG(interval) FROM poll_state",
+            (now + self.slack,),
+        ).fetchone()
+        tracked, due, shortest, longest, average = row
+        return {
+            "enabled": self.enabled,
+            "tracked": tracked,
+            "due": due or 0,
+            "min_interval": shortest,
+            "max_interval": longest,
+            "avg_interval": round(average, 1) if average is not None else None,
+            "max_staleness": self.max_staleness,
+        }
+
+
+# Function to split one cycle's results into the codes that changed and the ones that errored
+def poll_outcome(new_data, changed):
+    errored = [item["kode"] for item in new_data if item.get("price") == "Error"]
+    return [item["kode"] for item in changed], errored
@@ -1,14 +1,25 @@
-from decouple import config
 import os
 import requests
-import json
+import http_client
 from dotenv import load_dotenv
+from fetcher import fetch_concurrently, iter_concurrently
+from providers import TokovoucherProvider
+from price_store import PriceStore, PRICE_DB_FILE
+from poll_planner import PollPlanner
+from history_store import HistoryStore, HISTORY_DIR
+from diff_engine import detect_price_change
+from exporter import export_filename, render_export
+from export_cache import ExportCache
+from notifier import NotificationQueue, build_messages, build_summary, TELEGRAM_UNCHANGED_MODE
+from pipeline import run_pipeline
 
-# Base URL for the API
-BASE_URL = "https://api.tokovoucher.net/produk/code"
 # Load file .env
 load_dotenv()
 
+# Base URL for the API
+BASE_URL = os.getenv("TOKOVOUCHER_BASE_URL", "https://api.tokovoucher.net/produk/code")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+
 MEMBER_CODE = os.getenv("MEMBER_CODE")
 SIGNATURE = os.getenv("SIGNATURE")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
@@ -17,132 +28,120 @@ TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 print(f"TELEGRAM_TOKEN: {TELEGRAM_TOKEN}")
 print(f"TELEGRAM_CHAT_ID: {TELEGRAM_CHAT_ID}")
 
-# File untuk menyimpan data lama
+# File data lama (format lama), dimigrasi sekali ke database harga
 DATA_FILE = "data_old.json"
+price_store = PriceStore(PRICE_DB_FILE, legacy_json=DATA_FILE)
+# Riwayat perubahan per kode, kode yang harganya stabil lebih jarang dicek
+poll_planner = PollPlanner(PRICE_DB_FILE)
+# Riwayat semua harga yang diamati (Parquet per bulan)
+history_store = HistoryStore(HISTORY_DIR)
+# File export disimpan berdasarkan hash isinya, data yang sama tidak dirender ulang
+export_cache = ExportCache()
 
 # Function untuk mengirim pesan ke Telegram
-def send_telegram_message(message):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+def send_telegram_message(message, chat_id=None):
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendMessage"
     payload = {
-        "chat_id": TELEGRAM_CHAT_ID,
+        "chat_id": chat_id or TELEGRAM_CHAT_ID,
         "text": message,
         "parse_mode": "HTML"
     }
     try:
-        response = requests.post(url, data=payload)
+        response = http_client.post(url, data=payload)
         print(f"Response Telegram: {response.status_code} - {response.text}")
         response.raise_for_status()  # Akan melempar error jika status code >= 400
     except requests.exceptions.RequestException as e:
         print(f"Error saat mengirim notifikasi Telegram: {e}")
 
+# Antrian pengiriman Telegram dengan rate limit
+telegram_queue = NotificationQueue(lambda chat_id, text: send_telegram_message(text, chat_id))
+
+# Function untuk mengirim file ke Telegram (isi file dalam bytes)
+def send_telegram_file(filename, content, caption):
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendDocument"
+    try:
+        files = {"document": (filename, content)}
+        data = {"chat_id": TELEGRAM_CHAT_ID, "caption": caption}
+        response = http_client.post(url, data=data, files=files)
+        print(f"Response Telegram File: {response.status_code} - {response.text}")
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Error saat mengirim file ke Telegram: {e}")
+
+# Supplier untuk pengecekan harga
+tokovoucher = TokovoucherProvider(base_url=BASE_URL, member_code=MEMBER_CODE, signature=SIGNATURE)
+
+# Function untuk fetch satu kode
+def fetch_single_code(code, timeout):
+    return tokovoucher.fetch(code, timeout)
+
 # Function untuk fetch data
-def fetch_code_data(codes):
-    data = []
-    for code in codes:
-        url = f"{BASE_URL}?member_code={MEMBER_CODE}&signature={SIGNATURE}&kode={code}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            json_data = response.json()
-            if "data" in json_data and len(json_data["data"]) > 0:
-                produk_data = json_data["data"][0]  # Ambil elemen pertama
-                nama_produk = produk_data.get("nama_produk", "N/A")
-                price = produk_data.get("price", "N/A")
-                data.append({"kode": code, "nama_produk": nama_produk, "price": price})
-        else:
-            data.append({"kode": code, "nama_produk": "Error", "price": "Error"})
-    return data
+def fetch_code_data(codes, max_workers=None, timeout=None):
+    return fetch_concurrently(codes, fetch_single_code, max_workers, timeout)
+
+# Function untuk stream data yang diambil, satu per satu begitu tersedia
+def iter_code_data(codes, max_workers=None, timeout=None):
+    return iter_concurrently(codes, fetch_single_code, max_workers, timeout)
 
 # Function untuk membaca data lama
-def read_old_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r") as file:
-            return json.load(file)
-    return {}
+def read_old_data(codes=None):
+    return price_store.load(codes)
 
-# Function untuk menyimpan data baru
+# Function untuk menyimpan data baru (hanya baris yang berubah yang ditulis)
 def save_new_data(data):
-    with open(DATA_FILE, "w") as file:
-        json.dump(data, file, indent=4)
-
-# Function untuk mendeteksi perubahan harga
-def detect_price_change(new_data, old_data):
-    changed = []
-    unchanged = []
-    for item in new_data:
-        kode = item["kode"]
-        new_price = item["price"]
-        old_price = old_data.get(kode, {}).get("price")
-        if new_price != old_price:
-            changed.append({
-                "kode": kode,
-                "nama_produk": item["nama_produk"],
-                "price_baru": new_price,
-                "price_lama": old_price if old_price else "N/A"
-            })
-        else:
-            unchanged.append({
-                "kode": kode,
-                "nama_produk": item["nama_produk"],
-                "price": new_price
-            })
-    return changed, unchanged
+    price_store.save(data.values())
+
+# Function untuk mengecek harga per batch kecil: tiap batch dideteksi perubahannya dan disimpan dalam satu
+# transaksi database (proses lain tidak mengirim notifikasi yang sama), lalu on_changes(changed) dipanggil
+def check_prices(codes, on_changes=None, collect=False, keep_unchanged=False):
+    return run_pipeline(codes, iter_code_data, read_old_data, save_new_data, lock=price_store.locked,
+                        diff=detect_price_change, planner=poll_planner, history=history_store,
+                        on_changes=on_changes, collect=collect, keep_unchanged=keep_unchanged)
+
+# Function untuk menampilkan dan mengirim perubahan harga satu batch
+def notify_changes(changed):
+    print("Perubahan harga terdeteksi:")
+    for item in changed:
+        print(f"Kode: {item['kode']}, Nama: {item['nama_produk']}, Harga Lama: {item['price_lama']}, Harga Baru: {item['price_baru']}")
+    telegram_queue.put_many(TELEGRAM_CHAT_ID, build_messages(changed, unchanged_mode="none"))
 
 # Main function untuk memeriksa perubahan harga
 def main():
     codes = ["MLAWP1", "MLA12976", "MLA2195", "MLA1412", "MLA1220", "MLA878", "MLBB716"]  # Tambahkan kode lainnya sesuai kebutuhan
-    new_data = fetch_code_data(codes)
-
-    # Baca data lama
-    old_data = read_old_data()
 
-    if not old_data:  # Jika data lama tidak ada
+    # Jika data lama tidak ada, data pertama hanya disimpan sebagai data lama tanpa notifikasi
+    baseline = not read_old_data(codes)
+    if baseline:
         print("Data lama tidak ditemukan. Menyimpan data baru sebagai data lama...")
-        save_new_data({item["kode"]: item for item in new_data})
+
+    # Ambil hanya kode yang sudah jatuh tempo (sisanya memakai harga terakhir yang tersimpan);
+    # notifikasi dikirim per batch begitu perubahan tersimpan
+    result = check_prices(codes, on_changes=None if baseline else notify_changes, collect=True,
+                          keep_unchanged=TELEGRAM_UNCHANGED_MODE == "full")
+    if not result.fetched:
+        print("Tidak ada kode yang perlu dicek saat ini.")
+        return
+    if baseline:
         print("Data baru telah disimpan.")
         return
+    if result.unchanged:
+        print(f"Tidak ada perubahan harga untuk {result.unchanged} produk.")
+
+    # Ringkasan di akhir (perubahan sudah dikirim per batch)
+    unchanged = result.unchanged_items if result.unchanged_items is not None else result.unchanged
+    telegram_queue.put_many(TELEGRAM_CHAT_ID, build_summary(result.changed, unchanged))
 
-    # Deteksi perubahan harga
-    changed, unchanged = detect_price_change(new_data, old_data)
-
-    # Pesan notifikasi Telegram
-    message = ""
-    if changed:
-        print("Perubahan harga terdeteksi:")
-        message += "<b>Perubahan Harga Terdeteksi:</b>\n"
-        for item in changed:
-            print(f"Kode: {item['kode']}, Nama: {item['nama_produk']}, Harga Lama: {item['price_lama']}, Harga Baru: {item['price_baru']}")
-            message += (f"- Kode: <b>{item['kode']}</b>\n"
-                        f"  Nama: {item['nama_produk']}\n"
-                        f"  Harga Lama: <s>{item['price_lama']}</s>\n"
-                        f"  Harga Baru: <b>{item['price_baru']}</b>\n\n")
-    if unchanged:
-        print("Tidak ada perubahan harga untuk produk berikut:")
-        message += "<b>Tidak Ada Perubahan Harga:</b>\n"
-        for item in unchanged:
-            print(f"Kode: {item['kode']}, Nama: {item['nama_produk']}, Harga: {item['price']}")
-            message += (f"- Kode: <b>{item['kode']}</b>\n"
-                        f"  Nama: {item['nama_produk']}\n"
-                        f"  Harga: <b>{item['price']}</b>\n"
-                        f"  Tidak ada perubahan harga\n\n")
-
-    # Kirim notifikasi Telegram
-    send_telegram_message(message)
-
-    # Simpan data baru
-    save_new_data({item["kode"]: item for item in new_data})
-    
-    # Akses endpoint export_xlsx
+    # Ekspor Excel dari data yang sudah diambil (tanpa request kedua ke /export_xlsx)
     try:
-        export_response = requests.get("http://127.0.0.1:5000/export_xlsx?codes=" + ",".join(codes))
-        if export_response.status_code == 200:
-            print("File Excel berhasil diekspor!")
-            send_telegram_message("File Excel berhasil diekspor!")
-        else:
-            print(f"Gagal mengekspor file Excel. Status: {export_response.status_code}")
-            send_telegram_message(f"Gagal mengekspor file Excel. Status: {export_response.status_code}")
-    except requests.exceptions.ConnectionError as e:
-        print("Gagal menghubungi server untuk ekspor Excel:", e)
-        send_telegram_message("Gagal menghubungi server untuk ekspor Excel.")
+        content = export_cache.get_or_render(result.records, "xlsx", render_export)
+        send_telegram_file(export_filename("exported_data", "xlsx"), content, "File Excel berhasil diekspor!")
+        print("File Excel berhasil diekspor!")
+    except Exception as e:
+        print(f"Gagal mengekspor file Excel: {e}")
+        send_telegram_message(f"Gagal mengekspor file Excel: {e}")
+
+    # Tunggu sampai semua pesan di antrian terkirim
+    telegram_queue.join()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from metrics import stage_timer
+from records import Product, compact_price
+from diff_engine import compare_prices
+
+# SQLite database holding the latest price per kode and the full price history
+PRICE_DB_FILE = os.getenv("PRICE_DB_FILE", "prices.db")
+
+# Price value of a record whose lookup failed (see fetcher.error_record)
+ERROR_PRICE = "Error"
+
+# Default and max page size of the /changes feed
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", "1000"))
+CHANGES_PAGE_MAX = int(os.getenv("CHANGES_PAGE_MAX", "10000"))
+# Largest cursor value SQLite can store (signed 64 bit INTEGER)
+_SQLITE_INT_MAX = 2 ** 63 - 1
+
+# Max number of bound parameters per IN (...) query
+_CHUNK_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS latest_price (
+    kode TEXT PRIMARY KEY,
+    nama_produk TEXT,
+    price,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS price_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kode TEXT NOT NULL,
+    nama_produk TEXT,
+    price,
+    observed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_price_history_kode ON price_history (kode, observed_at);
+CREATE INDEX IF NOT EXISTS idx_price_history_kode_id ON price_history (kode, id);
+"""
+
+
+def _chunks(items, size=_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# Incremental price store: only changed rows are written, every write is one atomic transaction
+class PriceStore:
+    def __init__(self, path=PRICE_DB_FILE, legacy_json=None):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+        if legacy_json:
+            self.import_legacy_json(legacy_json)
+
+    # One connection per thread, WAL so readers never block the writer
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # Function to import an old data_old.json baseline once, when the store is still empty
+    def import_legacy_json(self, json_file):
+        if not os.path.exists(json_file):
+            return 0
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM latest_price LIMIT 1").fetchone():
+            return 0
+        try:
+            with open(json_file, "r") as file:
+                old_data = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Gagal membaca {json_file} untuk migrasi: {e}")
+            return 0
+        imported = self.save(old_data.values())
+        logging.info(f"{imported} kode dimigrasi dari {json_file} ke {self.path}")
+        return imported
+
+    # Function to load the latest known rows, optionally only for the given codes
+    def load(self, codes=None):
+        with stage_timer("load_old"):
+            return self._load(codes)
+
+    def _load(self, codes=None):
+        conn = self._connect()
+        query = "SELECT kode, nama_produk, price FROM latest_price"
+        if codes is None:
+            rows = conn.execute(query).fetchall()
+        else:
+            rows = []
+            for chunk in _chunks(list(dict.fromkeys(codes))):
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(conn.execute(f"{query} WHERE kode IN ({placeholders})", chunk).fetchall())
+        return {kode: Product(kode, nama_produk, price) for kode, nama_produk, price in rows}
+
+    # Function to save a snapshot, writing only rows whose price or name changed.
+    # Error records are skipped so a failed lookup keeps the last known good price.
+    # Returns the number of rows written.
+    def save(self, records, observed_at=None):
+        records = {item["kode"]: item for item in records if item.get("price") != ERROR_PRICE}
+        if not records:
+            return 0
+        with stage_timer("save", len(records)):
+            return self._save(records, observed_at or time.time())
+
+    # Function to hold the database write lock across several calls (e.g. diff + save), so no other
+    # thread or process can save in between. load() and save() inside the block join the transaction.
+    @contextmanager
+    def locked(self):
+        conn = self._connect()
+        if conn.in_transaction:
+            yield
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _save(self, records, observed_at):
+        with self.locked():
+            current = self._load(records.keys())
+            # Prices are compared and stored in compact form, so "15000" and 15000 are the same row
+            changed = [
+                (kode, item.get("nama_produk"), compact_price(item.get("price")), observed_at)
+                for kode, item in records.items()
+                if kode not in current
+                or current[kode].price != compact_price(item.get("price"))
+                or current[kode].nama_produk != item.get("nama_produk")
+            ]
+            if changed:
+                conn = self._connect()
+                conn.executemany(
+                    "INSERT INTO latest_price (kode, nama_produk, price, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(kode) DO UPDATE SET nama_produk = excluded.nama_produk, "
+                    "price = excluded.price, updated_at = excluded.updated_at",
+                    changed,
+                )
+                conn.executemany(
+                    "INSERT INTO price_history (kode, nama_produk, price, observed_at) VALUES (?, ?, ?, ?)",
+                    changed,
+                )
+        return len(changed)
+
+    # Function to get the current change cursor (id of the last price_history row, 0 when empty)
+    def cursor(self):
+        return self._connect().execute("SELECT COALESCE(MAX(id), 0) FROM price_history").fetchone()[0]
+
+    # Function to read the price changes saved after a cursor, oldest first, in the format of
+    # detect_price_change plus cursor and observed_at. Rows that only renamed a product are left out
+    # but still move the cursor. Returns (changes, next_cursor, more).
+    def changes(self, since=0, limit=CHANGES_PAGE_SIZE):
+        rows = self._connect().execute(
+            "SELECT h.id, h.kode, h.nama_produk, h.price, h.observed_at, "
+            "(SELECT p.price FROM price_history p WHERE p.kode = h.kode AND p.id < h.id ORDER BY p.id DESC LIMIT 1) "
+            "FROM price_history h WHERE h.id > ? ORDER BY h.id LIMIT ?",
+            (since, limit),
+        ).fetchall()
+        changes = []
+        for cursor, kode, nama_produk, price, observed_at, price_lama in rows:
+            if price_lama is None:
+                delta = delta_pct = None
+            else:
+                same, delta, delta_pct = compare_prices(price, price_lama)
+                if same:
+                    continue
+            changes.append({"cursor": cursor, "kode": kode, "nama_produk": nama_produk, "price_baru": price,
+                            "price_lama": "N/A" if price_lama is None else price_lama, "delta": delta,
+                            "delta_pct": delta_pct, "observed_at": observed_at})
+        next_cursor = rows[-1][0] if rows else since
+        return changes, next_cursor, len(rows) == limit
+
+    # Function to read the price history of one kode, oldest first
+    def history(self, kode, since=None, until=None):
+        query = "SELECT nama_produk, price, observed_at FROM price_history WHERE kode = ?"
+        params = [kode]
+        if since is not None:
+            query += " AND observed_at >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND observed_at <= ?"
+            params.append(until)
+        rows = self._connect().execute(query + " ORDER BY observed_at", params).fetchall()
+        return [{"kode": kode, "nama_produk": nama_produk, "price": price, "observed_at": observed_at}
+                for nama_produk, price, observed_at in rows]
+
+
+# Function to answer /changes from the query string; raises ValueError on bad parameters.
+# Without since only the current cursor is returned, so a new consumer starts from now.
+def changes_response(store, args):
+    try:
+        limit = int(args.get("limit") or CHANGES_PAGE_SIZE)
+        since = args.get("since")
+        since = None if since in (None, "") else int(since)
+    except ValueError:
+        raise ValueError("Parameter since dan limit harus berupa angka")
+    if limit <= 0 or (since is not None and since < 0):
+        raise ValueError("Parameter since dan limit tidak boleh negatif")
+    # SQLite integers are 64 bit; larger values would fail in the query instead of here
+    if since is not None and since > _SQLITE_INT_MAX:
+        raise ValueError(f"Parameter since maksimal {_SQLITE_INT_MAX}")
+    if since is None:
+        return {"changes": [], "cursor": store.cursor(), "more": False}
+    changes, cursor, more = store.changes(since, min(limit, CHANGES_PAGE_MAX))
+    return {"changes": changes, "cursor": cursor, "more": more}
@@ -0,0 +1,170 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from metrics import registry
+from records import Product
+
+# Cache settings: fresh lifetime, extra window where stale entries are still served, size bound
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_STALE_TTL = float(os.getenv("CACHE_STALE_TTL", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+
+
+# In-process product cache keyed by kode, with LRU eviction and stale-while-revalidate
+class ProductCache:
+    def __init__(self, ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # kode -> (record, fetched_at)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+
+    # Store records as compact Products; error records are never cached so the next call retries them
+    def put_many(self, records, now=None):
+        now = now or time.monotonic()
+        with self._lock:
+            for item in records:
+                if item.get("price") == "Error":
+                    continue
+                self._entries[item["kode"]] = (Product.of(item), now)
+                self._entries.move_to_end(item["kode"])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, codes=None):
+        with self._lock:
+            if codes is None:
+                self._entries.clear()
+            else:
+                for code in codes:
+                    self._entries.pop(code, None)
+
+    # Function to split codes into cached records, missing codes and stale codes to refresh
+    def _lookup(self, codes):
+        now = time.monotonic()
+        found = {}
+        missing = []
+        stale = []
+        with self._lock:
+            for code in dict.fromkeys(codes):
+                entry = self._entries.get(code)
+                if entry is None:
+                    self.misses += 1
+                    missing.append(code)
+                    continue
+                record, fetched_at = entry
+                age = now - fetched_at
+                if age <= self.ttl:
+                    self.hits += 1
+                elif age <= self.ttl + self.stale_ttl:
+                    self.stale_hits += 1
+                    stale.append(code)
+                else:
+                    self.misses += 1
+                    missing.append(code)
+                    continue
+                self._entries.move_to_end(code)
+                found[code] = record
+        return found, missing, stale
+
+    # Function to serve codes from the cache; loader(codes) fetches the missing ones.
+    # Expired entries inside the stale window are returned immediately and refreshed in the background.
+    def get_many(self, codes, loader):
+        found, missing, stale = self._lookup(codes)
+        if missing:
+            loaded = [Product.of(item) for item in loader(missing)]
+            self.put_many(loaded)
+            for item in loaded:
+                found[item["kode"]] = item
+        if stale:
+            self._schedule_refresh(stale, loader)
+
+        return [found[code] for code in codes if code in found]
+
+    # Streaming variant of get_many: cached records first, then each missing one as stream_loader yields it.
+    # The codes answered from the cache are added to `served` when given.
+    def iter_many(self, codes, stream_loader, served=None):
+        found, missing, stale = self._lookup(codes)
+        if stale:
+            self._schedule_refresh(stale, lambda refresh: list(stream_loader(refresh)))
+        if served is not None:
+            served.update(found)
+        yield from found.values()
+        if missing:
+            for item in stream_loader(missing):
+                item = Product.of(item)
+                self.put_many([item])
+                yield item
+
+    # Function to fetch every code with stream_loader, bypassing the cache, and store the results.
+    # Used when the caller asked for fresh data, so change detection never diffs a cached price.
+    def iter_refreshed(self, codes, stream_loader):
+        for item in stream_loader(list(dict.fromkeys(codes))):
+            item = Product.of(item)
+            self.put_many([item])
+            yield item
+
+    def _schedule_refresh(self, codes, loader):
+        with self._lock:
+            codes = [code for code in codes if code not in self._refreshing]
+            self._refreshing.update(codes)
+        if codes:
+            self.refreshes += 1
+            self._refresher.submit(self._refresh, codes, loader)
+
+    def _refresh(self, codes, loader):
+        try:
+            self.put_many(loader(codes))
+        except Exception as e:
+            logging.error(f"Background cache refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.difference_update(codes)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "refreshes": self.refreshes,
+                "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Shared cache instance used by the Flask handlers
+product_cache = ProductCache()
+
+
+# Expose the shared cache counters on /metrics
+def _cache_metrics():
+    stats = product_cache.stats()
+    lines = ["# HELP price_cache_lookups_total Product cache lookups by result.",
+             "# TYPE price_cache_lookups_total counter"]
+    for result in ("hits", "stale_hits", "misses"):
+        lines.append(f'price_cache_lookups_total{{result="{result}"}} {stats[result]}')
+    lines += ["# HELP price_cache_evictions_total Entries evicted by the LRU bound.",
+              "# TYPE price_cache_evictions_total counter",
+              f"price_cache_evictions_total {stats['evictions']}",
+              "# HELP price_cache_entries Entries currently cached.",
+              "# TYPE price_cache_entries gauge",
+              f"price_cache_entries {stats['entries']}"]
+    return lines
+
+
+registry.add_collector(_cache_metrics)
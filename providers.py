@@ -0,0 +1,291 @@
+import os
+import time
+import logging
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import http_client
+from fetcher import error_record, UpstreamError, UPSTREAM_FAILURES, is_upstream_status, FETCH_MAX_WORKERS, FETCH_TIMEOUT
+from metrics import registry, Histogram
+from records import Offer
+from upstream_guard import CircuitBreaker, TokenBucket, upstream_bucket
+from watchlists import parse_codes
+
+# Suppliers used by the fan-out: comma separated "name" (a known provider type with its default
+# settings) or "name=type:base_url". Credentials come from <NAME>_MEMBER_CODE / <NAME>_SIGNATURE,
+# falling back to MEMBER_CODE / SIGNATURE.
+PROVIDERS = os.getenv("PROVIDERS", "tokovoucher")
+# The fan-out waits this long for quotes before picking the cheapest; late quotes still update the view
+PROVIDER_DEADLINE = float(os.getenv("PROVIDER_DEADLINE", "3"))
+# Largest deadline= a /best_price request may ask for
+PROVIDER_DEADLINE_MAX = float(os.getenv("PROVIDER_DEADLINE_MAX", "30"))
+# Latency samples kept per provider for the p50/p95 stats
+PROVIDER_LATENCY_WINDOW = int(os.getenv("PROVIDER_LATENCY_WINDOW", "1000"))
+# Codes submitted per fan-out round, so a large request does not queue every lookup at once
+PROVIDER_BATCH = int(os.getenv("PROVIDER_BATCH", "500"))
+# Codes kept in the router's quote view; the least recently quoted ones are dropped beyond this
+PROVIDER_VIEW_MAX = int(os.getenv("PROVIDER_VIEW_MAX", "10000"))
+
+PROVIDER_SECONDS = registry.register(Histogram(
+    "price_provider_request_seconds", "Supplier lookup latency by provider and result.", labels=("provider", "result")))
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+# Function to read a price as a number for comparison, None for "Error", "N/A" and other text
+def price_value(price):
+    try:
+        value = float(price)
+    except (TypeError, ValueError):
+        return None
+    return value if value == value else None
+
+
+# Supplier adapter. Subclasses implement fetch(code, timeout), returning a record
+# {"kode", "nama_produk", "price"}, None when the supplier does not sell the code, or
+# fetcher.error_record(code) on failure; they raise fetcher.UpstreamError when the supplier itself
+# fails (HTTP 5xx/429). quote() adds the token bucket, circuit breaker and latency stats.
+class Provider:
+    def __init__(self, name, bucket=None):
+        self.name = name
+        self.bucket = bucket or TokenBucket()
+        self.breaker = CircuitBreaker(name=name)
+        self._latencies = deque(maxlen=PROVIDER_LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.short_circuited = 0
+
+    def fetch(self, code, timeout=None):
+        raise NotImplementedError
+
+    # Function to get this supplier's Offer for a code; None when it has no valid price
+    def quote(self, code, timeout=None):
+        if not self.breaker.allow():
+            with self._lock:
+                self.short_circuited += 1
+            return None
+        upstream_failed = None
+        try:
+            self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                item = self.fetch(code, timeout)
+            except UPSTREAM_FAILURES as e:
+                logging.error(f"Supplier {self.name} gagal untuk kode {code}: {e}")
+                item, upstream_failed = error_record(code), True
+            except Exception as e:
+                logging.error(f"Supplier {self.name} error untuk kode {code}: {e}")
+                item = error_record(code)
+            else:
+                upstream_failed = False
+            latency = time.perf_counter() - start
+            failed = item is not None and item.get("price") == "Error"
+            result = "error" if failed else "empty" if item is None else "ok"
+            PROVIDER_SECONDS.observe(latency, self.name, result)
+            with self._lock:
+                self.requests += 1
+                self.errors += failed
+                self._latencies.append(latency)
+        finally:
+            # Only supplier failures count toward its breaker; local errors just give back the probe slot
+            if upstream_failed:
+                self.breaker.record_failure()
+            elif upstream_failed is False:
+                self.breaker.record_success()
+            else:
+                self.breaker.release()
+        if failed or item is None or price_value(item.get("price")) is None:
+            return None
+        return Offer(code, item.get("nama_produk"), item.get("price"), self.name, round(latency, 4))
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            stats = {"requests": self.requests, "errors": self.errors, "short_circuited": self.short_circuited}
+        p50, p95 = _percentile(latencies, 50), _percentile(latencies, 95)
+        stats["p50_ms"] = round(p50 * 1000, 2) if p50 is not None else None
+        stats["p95_ms"] = round(p95 * 1000, 2) if p95 is not None else None
+        stats["breaker"] = self.breaker.status()["state"]
+        return stats
+
+
+# tokovoucher.net: GET /produk/code?member_code=&signature=&kode=, product in data[0]
+class TokovoucherProvider(Provider):
+    def __init__(self, name="tokovoucher", base_url=None, member_code=None, signature=None, bucket=None):
+        super().__init__(name, bucket)
+        self.base_url = base_url or os.getenv("TOKOVOUCHER_BASE_URL", "https://api.tokovoucher.net/produk/code")
+        self.member_code = member_code
+        self.signature = signature
+
+    def fetch(self, code, timeout=None):
+        url = f"{self.base_url}?member_code={self.member_code}&signature={self.signature}&kode={code}"
+        response = http_client.get(url, timeout=timeout)
+        if is_upstream_status(response.status_code):
+            raise UpstreamError(code, response.status_code)
+        if response.status_code != 200:
+            return error_record(code)
+        return self.parse(code, response.json())
+
+    # Function to normalize a tokovoucher response; None when it has no product for the code
+    def parse(self, code, json_data):
+        data = json_data.get("data") if isinstance(json_data, dict) else None
+        if isinstance(data, list) and data and isinstance(data[0], dict):
+            produk_data = data[0]
+            return {"kode": code, "nama_produk": produk_data.get("nama_produk", "N/A"),
+                    "price": produk_data.get("price", "N/A")}
+        return None
+
+
+# Provider types by name, for PROVIDERS entries
+PROVIDER_TYPES = {
+    "tokovoucher": TokovoucherProvider,
+}
+
+
+# Function to build the providers listed in spec (see PROVIDERS); environment is read at call time.
+# Providers on the same base_url share one token bucket, the default tokovoucher url shares the
+# fetcher's upstream_bucket.
+def load_providers(spec=None):
+    providers = []
+    buckets = {os.getenv("TOKOVOUCHER_BASE_URL", "https://api.tokovoucher.net/produk/code"): upstream_bucket}
+    for entry in (spec if spec is not None else os.getenv("PROVIDERS", PROVIDERS)).split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, target = entry.partition("=")
+        kind, _, base_url = (target or name).partition(":")
+        if kind not in PROVIDER_TYPES:
+            raise ValueError(f"Tipe provider tidak dikenal: {kind!r} (pilihan: {', '.join(PROVIDER_TYPES)})")
+        prefix = name.upper().replace("-", "_")
+        providers.append(PROVIDER_TYPES[kind](
+            name=name, base_url=base_url or None,
+            member_code=os.getenv(f"{prefix}_MEMBER_CODE", os.getenv("MEMBER_CODE")),
+            signature=os.getenv(f"{prefix}_SIGNATURE", os.getenv("SIGNATURE")),
+        ))
+        providers[-1].bucket = buckets.setdefault(providers[-1].base_url, providers[-1].bucket)
+    return providers
+
+
+# Queries every supplier for the same codes concurrently and keeps, per kode, the latest quote of
+# each supplier and the cheapest one among them (at most view_max codes, least recently quoted out first)
+class SupplierRouter:
+    def __init__(self, providers, max_workers=None, deadline=PROVIDER_DEADLINE, timeout=None,
+                 view_max=PROVIDER_VIEW_MAX):
+        self.providers = list(providers)
+        self.deadline = deadline
+        self.timeout = timeout or FETCH_TIMEOUT
+        self.view_max = view_max
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or FETCH_MAX_WORKERS,
+                                            thread_name_prefix="supplier")
+        self._quotes = OrderedDict()  # kode -> {provider name: Offer}
+        self._best = {}  # kode -> cheapest Offer
+        self._lock = threading.Lock()
+
+    def _record(self, code, provider, offer):
+        with self._lock:
+            quotes = self._quotes.setdefault(code, {})
+            self._quotes.move_to_end(code)
+            if offer is None:
+                quotes.pop(provider.name, None)
+            else:
+                quotes[provider.name] = offer
+            if quotes:
+                self._best[code] = min(quotes.values(), key=lambda item: (price_value(item.price), item.latency))
+            else:
+                self._quotes.pop(code, None)
+                self._best.pop(code, None)
+            while self.view_max and len(self._quotes) > self.view_max:
+                evicted, _ = self._quotes.popitem(last=False)
+                self._best.pop(evicted, None)
+
+    def _quote(self, provider, code):
+        self._record(code, provider, provider.quote(code, self.timeout))
+
+    # Function to fan out the codes to every supplier and return kode -> cheapest Offer.
+    # Only quotes that arrive within the deadline count for this call; later ones update the view.
+    # Lookups still queued when the deadline passes are cancelled, and later batches are not sent.
+    def quote_many(self, codes, deadline=None):
+        deadline = self.deadline if deadline is None else deadline
+        end = time.monotonic() + deadline
+        codes = list(dict.fromkeys(code for code in codes if code))
+        for start in range(0, len(codes), PROVIDER_BATCH):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            futures = [self._executor.submit(self._quote, provider, code)
+                       for code in codes[start:start + PROVIDER_BATCH] for provider in self.providers]
+            _, pending = wait(futures, timeout=remaining)
+            for future in pending:
+                future.cancel()
+        with self._lock:
+            return {code: self._best[code] for code in codes if code in self._best}
+
+    # Function to read the cheapest known Offer per kode without querying (all codes when None)
+    def best(self, codes=None):
+        with self._lock:
+            if codes is None:
+                return dict(self._best)
+            return {code: self._best[code] for code in codes if code in self._best}
+
+    def stats(self):
+        with self._lock:
+            wins = {}
+            for offer in self._best.values():
+                wins[offer.provider] = wins.get(offer.provider, 0) + 1
+            tracked = len(self._best)
+        providers = {}
+        for provider in self.providers:
+            providers[provider.name] = provider.stats()
+            providers[provider.name]["cheapest"] = wins.get(provider.name, 0)
+        return {"providers": providers, "tracked": tracked, "deadline": self.deadline}
+
+
+# Function to answer /best_price from the query string; raises ValueError on bad parameters
+def best_price_response(router, args):
+    codes = parse_codes(args.get("codes"))
+    if not codes:
+        raise ValueError("Parameter codes wajib diisi")
+    deadline = args.get("deadline")
+    try:
+        deadline = None if deadline in (None, "") else float(deadline)
+    except ValueError:
+        raise ValueError("Parameter deadline harus berupa angka (detik)")
+    if deadline is not None and not 0 < deadline <= PROVIDER_DEADLINE_MAX:
+        raise ValueError(f"Parameter deadline harus lebih dari 0 dan maksimal {PROVIDER_DEADLINE_MAX:g} detik")
+    best = router.quote_many(codes, deadline)
+    return {
+        "best": [dict(best[code]) for code in codes if code in best],
+        "missing": [code for code in codes if code not in best],
+    }
+
+
+# Compare local mock suppliers: python3 providers.py --mock 3 --codes 200
+if __name__ == "__main__":
+    import argparse
+    from mock_upstream import MockConfig, start_mock_server
+
+    parser = argparse.ArgumentParser(description="Fan out lookups to several suppliers and show the cheapest")
+    parser.add_argument("--mock", type=int, default=3, help="number of local mock suppliers to start")
+    parser.add_argument("--codes", type=int, default=200)
+    parser.add_argument("--deadline", type=float, default=PROVIDER_DEADLINE)
+    args = parser.parse_args()
+
+    config = MockConfig(catalog_size=args.codes)
+    servers = [start_mock_server(MockConfig(catalog_size=args.codes, latency=0.01 * (i + 1), price_seed=i + 1))
+               for i in range(args.mock)]
+    spec = ",".join(f"mock{i + 1}=tokovoucher:{server.base_url}/produk/code" for i, server in enumerate(servers))
+    router = SupplierRouter(load_providers(spec), deadline=args.deadline)
+    start = time.perf_counter()
+    best = router.quote_many(config.catalog_codes())
+    print(f"{len(best)} kode dalam {time.perf_counter() - start:.2f} s")
+    for name, stats in router.stats()["providers"].items():
+        print(f"  {name}: {stats}")
+    for server in servers:
+        server.shutdown()
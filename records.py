@@ -0,0 +1,171 @@
+import sys
+import hashlib
+import threading
+from array import array
+from collections.abc import Mapping
+
+# ProductTable keeps integer prices in an int64 array; other prices ("Error", "N/A", floats, None)
+# are marked with this value and kept in a small side dict
+_OTHER_PRICE = -(2 ** 63)
+
+
+# Product names used by every ProductTable in the process, stored once: name -> id and id -> name
+_names = []
+_name_ids = {}
+_names_lock = threading.Lock()
+
+
+def _name_id(name):
+    name_id = _name_ids.get(name)
+    if name_id is None:
+        with _names_lock:
+            name_id = _name_ids.get(name)
+            if name_id is None:
+                name_id = _name_ids[name] = len(_names)
+                _names.append(name)
+    return name_id
+
+
+def intern_text(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+# Function to store a price compactly: digit strings become int, other text is interned,
+# anything else (int, float, None) is kept as it is
+def compact_price(value):
+    if type(value) is str:
+        if value.isascii() and value.isdigit() and (len(value) == 1 or value[0] != "0"):
+            return int(value)
+        return sys.intern(value)
+    return value
+
+
+# Function to get a version of a snapshot that changes whenever a kode, name or price changes
+# (used as ETag). Prices are compared in compact form, so "15000" and 15000 give the same version.
+def snapshot_version(records):
+    digest = hashlib.sha256()
+    for item in records:
+        digest.update(f"{item.get('kode')}\0{item.get('nama_produk')}\0{compact_price(item.get('price'))}\n"
+                      .encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+# Read-only record with fixed fields in __slots__; behaves like the dict it replaces
+# (item["kode"], item.get("price"), dict(item), == against a dict)
+class _Record(Mapping):
+    __slots__ = ()
+    _fields = ()
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __reduce__(self):
+        return (type(self), tuple(getattr(self, field) for field in self._fields))
+
+
+# One product snapshot row: {"kode", "nama_produk", "price"} in about a third of a dict's memory.
+# kode and nama_produk are interned, so every snapshot in the process shares the same strings.
+class Product(_Record):
+    __slots__ = ("kode", "nama_produk", "price")
+    _fields = __slots__
+
+    def __init__(self, kode, nama_produk=None, price=None):
+        self.kode = intern_text(kode)
+        self.nama_produk = intern_text(nama_produk)
+        self.price = compact_price(price)
+
+    # Function to convert a record dict (or a Product, returned as is)
+    @classmethod
+    def of(cls, item):
+        if type(item) is cls:
+            return item
+        return cls(item.get("kode"), item.get("nama_produk"), item.get("price"))
+
+
+# One changed product from detect_price_change
+class Change(_Record):
+    __slots__ = ("kode", "nama_produk", "price_baru", "price_lama", "delta", "delta_pct")
+    _fields = __slots__
+
+    def __init__(self, kode, nama_produk, price_baru, price_lama, delta=None, delta_pct=None):
+        self.kode = intern_text(kode)
+        self.nama_produk = intern_text(nama_produk)
+        self.price_baru = price_baru
+        self.price_lama = price_lama
+        self.delta = delta
+        self.delta_pct = delta_pct
+
+
+# One supplier's quote for a product (see providers.py); latency is the lookup time in seconds
+class Offer(_Record):
+    __slots__ = ("kode", "nama_produk", "price", "provider", "latency")
+    _fields = __slots__
+
+    def __init__(self, kode, nama_produk, price, provider, latency=None):
+        self.kode = intern_text(kode)
+        self.nama_produk = intern_text(nama_produk)
+        self.price = compact_price(price)
+        self.provider = intern_text(provider)
+        self.latency = latency
+
+
+# Array-backed list of products for large snapshots: kode per row, product names as ids into a
+# process-wide pool, integer prices in an int64 array. Iterating or indexing yields Product rows.
+class ProductTable:
+    def __init__(self, records=()):
+        self.kodes = []
+        self.name_ids = array("I")
+        self.prices = array("q")
+        self._other_prices = {}  # row -> price that is not an int64
+        self.extend(records)
+
+    def append(self, item):
+        name_id = _name_id(intern_text(item.get("nama_produk")))
+        price = compact_price(item.get("price"))
+        row = len(self.kodes)
+        self.kodes.append(intern_text(item.get("kode")))
+        self.name_ids.append(name_id)
+        if type(price) is int and _OTHER_PRICE < price < 2 ** 63:
+            self.prices.append(price)
+        else:
+            self.prices.append(_OTHER_PRICE)
+            self._other_prices[row] = price
+
+    def extend(self, records):
+        for item in records:
+            self.append(item)
+
+    def __len__(self):
+        return len(self.kodes)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self.kodes)
+        price = self.prices[row]
+        if price == _OTHER_PRICE:
+            price = self._other_prices[row]
+        return Product(self.kodes[row], _names[self.name_ids[row]], price)
+
+    def __iter__(self):
+        for row in range(len(self.kodes)):
+            yield self[row]
+
+    # Function to reorder rows in place, like list.sort(key=...) on the Product rows
+    def sort(self, key):
+        order = sorted(range(len(self.kodes)), key=lambda row: key(self[row]))
+        other = self._other_prices
+        self.kodes = [self.kodes[row] for row in order]
+        self.name_ids = array("I", (self.name_ids[row] for row in order))
+        self.prices = array("q", (self.prices[row] for row in order))
+        self._other_prices = {new: other[old] for new, old in enumerate(order) if old in other}
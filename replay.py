@@ -0,0 +1,381 @@
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import zlib
+import atexit
+import logging
+import threading
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+
+# Entries written between two gzip flushes; a killed process loses at most this many
+CAPTURE_FLUSH_EVERY = int(os.getenv("CAPTURE_FLUSH_EVERY", "500"))
+# Query parameters that are never written to an archive
+_SECRET_PARAMS = ("member_code", "signature")
+
+
+# Records raw upstream responses with their timing into a gzip JSON lines archive: a header line,
+# then one line per request {"t", "kode", "url", "status", "elapsed", "body"} (or "error" when the
+# request failed), where t is the wall-clock start of the request. Credentials are stripped from the URL.
+class CaptureWriter:
+    def __init__(self, path):
+        self.path = path.replace("{pid}", str(os.getpid()))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = gzip.open(self.path, "at", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.recorded = 0
+        self._write({"capture": 1, "started_at": time.time(), "pid": os.getpid()})
+        atexit.register(self.close)
+        logging.info(f"Merekam respons upstream ke {self.path}")
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    # Function to record one GET; response is None when the request raised error
+    def record(self, url, response, elapsed, error=None):
+        parts = urlsplit(url)
+        query = parse_qs(parts.query)
+        entry = {
+            "t": round(time.time() - elapsed, 4),
+            "kode": query.get("kode", [None])[0],
+            "url": f"{parts.scheme}://{parts.netloc}{parts.path}",
+            "elapsed": round(elapsed, 4),
+        }
+        extra = {key: value[0] for key, value in query.items() if key not in _SECRET_PARAMS and key != "kode"}
+        if extra:
+            entry["params"] = extra
+        if response is None:
+            entry["error"] = f"{type(error).__name__}: {error}"
+        else:
+            entry["status"] = response.status_code
+            entry["body"] = response.text
+        with self._lock:
+            if self._file is None:
+                return
+            self._write(entry)
+            self.recorded += 1
+            self._pending += 1
+            if self._pending >= CAPTURE_FLUSH_EVERY:
+                self._file.flush()
+                self._pending = 0
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# Function to read the request entries of one or more archives (paths may be globs), oldest first
+# per file. A truncated archive (process killed while capturing) is read up to the damaged part.
+def read_capture(paths):
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for path in paths:
+        files.extend(sorted(glob.glob(path)) or [path])
+    for path in files:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logging.warning(f"Baris rusak di {path} dilewati")
+                        continue
+                    if "capture" not in entry:
+                        yield entry
+        except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+            logging.warning(f"Arsip {path} terpotong, dibaca sampai bagian yang rusak: {e}")
+
+
+# Response object handed to the adapters during replay (status_code, text, json())
+class ReplayResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.text)
+
+
+_NOT_FOUND = {"status": 200, "body": json.dumps({"status": 1, "data": []}), "elapsed": 0.0}
+
+
+# Serves captured responses in place of http_client.get. Each kode answers with its recorded
+# responses in order (the last one repeats), so an archive of several cycles replays the price changes.
+# speed 1 waits the recorded latency per request, 2 half of it, 0 answers at once.
+class ReplayUpstream:
+    def __init__(self, entries, speed=1.0):
+        self.speed = speed
+        self._responses = {}
+        for entry in entries:
+            if entry.get("kode"):
+                self._responses.setdefault(entry["kode"], []).append(entry)
+        self._queues = {}
+        self._aliases = {}
+        self._lock = threading.Lock()
+        self.served = 0
+        self.missing = 0
+
+    # Function to get the codes to check: the recorded ones, or `scale` codes where the extra ones
+    # are copies of the recorded responses (to size a larger catalog on the same data shapes)
+    def codes(self, scale=None):
+        recorded = list(self._responses)
+        if not scale or scale <= len(recorded) or not recorded:
+            return recorded[:scale] if scale else recorded
+        codes = list(recorded)
+        for index in range(len(recorded), scale):
+            source = recorded[index % len(recorded)]
+            alias = f"{source}_{index // len(recorded)}"
+            self._aliases[alias] = source
+            codes.append(alias)
+        return codes
+
+    def _next(self, kode):
+        source = self._aliases.get(kode, kode)
+        with self._lock:
+            queue = self._queues.get(kode)
+            if queue is None:
+                queue = self._queues[kode] = deque(self._responses.get(source) or [_NOT_FOUND])
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+            self.served += 1
+            self.missing += source not in self._responses
+        return entry
+
+    # Function with the signature of http_client.get
+    def get(self, url, timeout=None, **kwargs):
+        kode = parse_qs(urlsplit(url).query).get("kode", [None])[0]
+        entry = self._next(kode)
+        if self.speed and entry.get("elapsed"):
+            time.sleep(entry["elapsed"] / self.speed)
+        if "error" in entry:
+            import requests
+            raise requests.exceptions.ConnectionError(f"replay: {entry['error']}")
+        return ReplayResponse(entry["status"], entry["body"])
+
+    # Function to route http_client.get to the archive; returns a restore callback
+    def install(self):
+        import http_client
+        original = http_client.get
+        http_client.get = self.get
+
+        def restore():
+            http_client.get = original
+        return restore
+
+    def stats(self):
+        with self._lock:
+            return {"codes": len(self._responses), "responses": sum(map(len, self._responses.values())),
+                    "served": self.served, "missing": self.missing}
+
+
+# Stdlib sampling profiler: every `interval` seconds the stack of every thread is counted.
+# Unlike cProfile it also sees the fetch worker threads and adds almost no overhead per call.
+class StackSampler:
+    # Stacks ending in these files are idle threads (pool workers waiting for work)
+    IDLE_FILES = ("threading.py", "thread.py", "queue.py", "selectors.py")
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or os.path.basename(frame.f_code.co_filename) in self.IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                # Request threads of the local Telegram simulator are not part of the pipeline
+                if "socketserver.py" in key:
+                    continue
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    # Function to write the stacks in collapsed format ("a;b;c count"), the input of flamegraph.pl
+    # and speedscope
+    def write_folded(self, path):
+        with open(path, "w") as file:
+            for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]):
+                file.write(f"{stack} {count}\n")
+
+    # Function to list the functions with the most samples: (function, self samples, total samples)
+    def top(self, limit=25):
+        own, total = {}, {}
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for name in set(frames):
+                total[name] = total.get(name, 0) + count
+        return sorted(((name, own.get(name, 0), total[name]) for name in total), key=lambda row: -row[1])[:limit]
+
+
+# Function to replay an archive through one benchmark pipeline, `warmup` unprofiled cycles first
+# (they build the stored baseline), then the profiled cycle. Returns the benchmark stage report.
+def replay_pipeline(name, codes, workdir, profile="cprofile", output=None, warmup=1, top=25):
+    import benchmark
+
+    for _ in range(warmup):
+        benchmark.run_pipeline(name, len(codes), workdir, track_memory=False, codes=codes)
+
+    if profile == "cprofile":
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profile == "sample":
+        profiler = StackSampler()
+        profiler.start()
+    try:
+        report = benchmark.run_pipeline(name, len(codes), workdir, track_memory=False, codes=codes)
+    finally:
+        if profile == "cprofile":
+            profiler.disable()
+        elif profile == "sample":
+            profiler.stop()
+
+    benchmark.print_report(name, report)
+    if profile == "cprofile":
+        if output:
+            profiler.dump_stats(f"{output}.prof")
+            print(f"  cProfile: {output}.prof (snakeviz / python -m pstats)")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+    elif profile == "sample":
+        if output:
+            profiler.write_folded(f"{output}.folded")
+            print(f"  Sampling: {output}.folded ({profiler.samples} sampel, format flamegraph)")
+        print(f"  {'self':>7}{'total':>8}  function")
+        for function, own, total in profiler.top(top):
+            print(f"  {own:>7}{total:>8}  {function}")
+    return report
+
+
+# Function for `replay.py capture`: fetch codes once through the real upstream with recording on,
+# without touching the price database (e.g. a catalog that is not onboarded yet)
+def capture(args):
+    import http_client
+    http_client.UPSTREAM_CAPTURE = args.archive
+    import check_price
+
+    if args.watchlists:
+        from watchlists import union_codes
+        codes = union_codes(check_price.watchlist_store.active())
+    else:
+        from watchlists import parse_codes
+        codes = parse_codes(args.codes, max_codes=0)
+    if not codes:
+        print("Tidak ada kode untuk direkam (gunakan --codes atau --watchlists).")
+        return 1
+    start = time.perf_counter()
+    for _ in range(args.cycles):
+        for _ in check_price.iter_code_data(codes):
+            pass
+    writer = http_client.get_capture()
+    writer.close()
+    print(f"{writer.recorded} respons dari {len(codes)} kode direkam ke {writer.path} "
+          f"dalam {time.perf_counter() - start:.2f} s ({os.path.getsize(writer.path) / 1e6:.2f} MB)")
+    return 0
+
+
+# Function for `replay.py replay`: run the recorded traffic offline through the pipelines
+def replay(args):
+    import tempfile
+    import importlib
+    from mock_upstream import MockConfig, start_mock_server, mock_environment
+
+    upstream = ReplayUpstream(read_capture(args.archive), speed=args.speed)
+    codes = upstream.codes(args.scale)
+    if not codes:
+        print(f"Arsip {args.archive} tidak berisi respons.")
+        return 1
+    output = os.path.abspath(args.output) if args.output else None
+
+    # Telegram goes to the local simulator; every GET is answered from the archive
+    server = start_mock_server(MockConfig(catalog_size=0, latency=0, latency_jitter=0))
+    workdir = tempfile.mkdtemp(prefix="price-replay-")
+    os.environ.update(mock_environment(server))
+    os.environ["PRICE_DB_FILE"] = os.path.join(workdir, "prices.db")
+    os.environ.setdefault("UPSTREAM_RATE", "0")
+    # Every code is fetched in every cycle unless the polling plan is part of what is measured
+    os.environ["POLL_ADAPTIVE"] = "1" if args.adaptive else "0"
+    os.environ.setdefault("TELEGRAM_PER_CHAT_INTERVAL", "0")
+    os.environ.setdefault("TELEGRAM_GLOBAL_RATE", "0")
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import benchmark
+    names = [name.strip() for name in args.pipelines.split(",") if name.strip()]
+    for name in names:
+        importlib.import_module(benchmark.PIPELINES[name][0])
+    logging.getLogger().setLevel(logging.WARNING)
+
+    restore = upstream.install()
+    print(f"Replay {len(codes)} kode dari {args.archive}, speed {args.speed or 'maksimum'}")
+    try:
+        for name in names:
+            safe_name = "".join(ch if ch.isalnum() else "_" for ch in name)
+            replay_pipeline(name, codes, workdir, args.profile,
+                            f"{output}-{safe_name}" if output else None, args.warmup, args.top)
+    finally:
+        restore()
+        server.shutdown()
+    print(f"\nReplay: {upstream.stats()}")
+    return 0
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record upstream responses and replay them offline with profiling")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("capture", help="fetch codes once with recording on")
+    record.add_argument("archive", help="archive to write, e.g. capture.jsonl.gz")
+    record.add_argument("--codes", default="", help="comma separated codes")
+    record.add_argument("--watchlists", action="store_true", help="all codes of the active watchlists")
+    record.add_argument("--cycles", type=int, default=1, help="fetch the codes this many times")
+
+    play = commands.add_parser("replay", help="feed an archive through the pipelines offline")
+    play.add_argument("archive", help="archive path or glob (e.g. 'capture-*.jsonl.gz' from several workers)")
+    play.add_argument("--pipelines", default="check_price.py main", help="comma separated benchmark.py pipelines")
+    play.add_argument("--speed", type=float, default=0.0, help="1 = recorded latency, 0 = as fast as possible")
+    play.add_argument("--scale", type=int, default=0, help="number of codes (recorded data repeated to fill)")
+    play.add_argument("--profile", choices=("cprofile", "sample", "none"), default="cprofile")
+    play.add_argument("--warmup", type=int, default=1, help="unprofiled cycles that build the baseline first")
+    play.add_argument("--adaptive", action="store_true", help="keep adaptive polling on")
+    play.add_argument("--top", type=int, default=25, help="functions shown in the profile summary")
+    play.add_argument("--output", help="file prefix for the .prof / .folded profile")
+
+    args = parser.parse_args(argv)
+    return capture(args) if args.command == "capture" else replay(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import os
+import time
+import random
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process leader election, every process runs its jobs
+    fcntl = None
+
+# Default interval (seconds) and jitter (fraction of the interval) for scheduled jobs
+SCHEDULE_INTERVAL = float(os.getenv("SCHEDULE_INTERVAL", "900"))
+SCHEDULE_JITTER = float(os.getenv("SCHEDULE_JITTER", "0.1"))
+
+
+# One named job; the lock guarantees two runs of the same job never overlap
+class Job:
+    def __init__(self, name, func, interval, jitter, run_at_start=True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.run_at_start = run_at_start
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_started = None
+        self.last_duration = None
+        self.last_error = None
+        self.next_run = None
+
+    def next_delay(self):
+        spread = self.interval * self.jitter
+        return max(0.0, self.interval + random.uniform(-spread, spread))
+
+    # Function to run the job once; returns False if a previous run is still going
+    def run(self):
+        if not self.lock.acquire(blocking=False):
+            self.skipped += 1
+            logging.warning(f"Job {self.name} masih berjalan, run ini dilewati.")
+            return False
+        try:
+            self.last_started = time.time()
+            start = time.perf_counter()
+            try:
+                self.func()
+                self.last_error = None
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                logging.error(f"Job {self.name} gagal: {e}", exc_info=True)
+            self.last_duration = round(time.perf_counter() - start, 3)
+            self.runs += 1
+            logging.info(f"Job {self.name} selesai dalam {self.last_duration} detik.")
+            return True
+        finally:
+            self.lock.release()
+
+    def status(self):
+        return {
+            "interval": self.interval,
+            "jitter": self.jitter,
+            "running": self.lock.locked(),
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "last_started": self.last_started,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+            "next_run": self.next_run,
+        }
+
+
+# File used to elect one scheduler leader when several processes (e.g. gunicorn workers) start it
+SCHEDULER_LOCK_FILE = os.getenv("SCHEDULER_LOCK_FILE", "scheduler.lock")
+
+
+# Non-blocking exclusive file lock; the holder stays leader until its process exits
+class LeaderLock:
+    def __init__(self, path=SCHEDULER_LOCK_FILE):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._file is not None or fcntl is None:
+                return True
+            file = open(self.path, "a")
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                file.close()
+                return False
+            self._file = file
+            logging.info(f"Proses {os.getpid()} menjadi leader scheduler ({self.path}).")
+            return True
+
+    @property
+    def is_leader(self):
+        return self._file is not None or fcntl is None
+
+
+# In-process interval scheduler: every job gets its own thread and runs at interval +/- jitter
+class Scheduler:
+    def __init__(self, leader_lock=None):
+        self.leader_lock = leader_lock
+        self.standby = 0
+        self.jobs = {}
+        self._stop = threading.Event()
+        self._threads = []
+
+    def add_job(self, name, func, interval=SCHEDULE_INTERVAL, jitter=SCHEDULE_JITTER, run_at_start=True):
+        job = Job(name, func, interval, jitter, run_at_start)
+        self.jobs[name] = job
+        return job
+
+    def _loop(self, job):
+        delay = 0.0 if job.run_at_start else job.next_delay()
+        while True:
+            job.next_run = time.time() + delay
+            if self._stop.wait(delay):
+                return
+            # With a leader lock only the process holding it runs jobs; the others keep trying to take over
+            if self.leader_lock is None or self.leader_lock.acquire():
+                job.run()
+            else:
+                self.standby += 1
+            delay = job.next_delay()
+
+    def start(self):
+        for job in self.jobs.values():
+            thread = threading.Thread(target=self._loop, args=(job,), name=f"job-{job.name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"Scheduler berjalan dengan job: {', '.join(self.jobs)}")
+
+    # Function to block the caller until stop() is called (daemon mode)
+    def run_forever(self):
+        self.start()
+        try:
+            while not self._stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self):
+        self._stop.set()
+
+    # Function to trigger a job right away, still respecting the no-overlap rule
+    def run_now(self, name):
+        return self.jobs[name].run()
+
+    def status(self):
+        status = {name: job.status() for name, job in self.jobs.items()}
+        if self.leader_lock is not None:
+            status["_leader"] = {"pid": os.getpid(), "is_leader": self.leader_lock.is_leader,
+                                 "standby_ticks": self.standby}
+        return status
@@ -0,0 +1,71 @@
+import os
+import sys
+import argparse
+import importlib
+
+# Production serving with gunicorn: worker processes (default one per core) x threads per worker
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", str(os.cpu_count() or 1)))
+SERVE_THREADS = int(os.getenv("SERVE_THREADS", "4"))
+SERVE_TIMEOUT = int(os.getenv("SERVE_TIMEOUT", "120"))
+
+# Service name -> (module, default bind address)
+SERVICES = {
+    "ML": ("ML", "0.0.0.0:5001"),
+    "check_price": ("check_price", "0.0.0.0:5000"),
+    "app": ("app", "127.0.0.1:5000"),
+}
+
+
+# Function to start background work in every worker once the app is loaded: the outbox worker
+# (claims are atomic, so workers never send the same record twice) and, if enabled, the scheduler
+# (only the worker holding the leader lock runs jobs)
+def _post_worker_init(module_name):
+    def hook(worker):
+        module = importlib.import_module(module_name)
+        if hasattr(module, "outbox"):
+            module.outbox.start()
+        if hasattr(module, "register_jobs") and os.getenv("SCHEDULE_ENABLED", "0") == "1":
+            module.register_jobs()
+            module.scheduler.start()
+    return hook
+
+
+def run(service, bind=None, workers=None, threads=None):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit("gunicorn belum terpasang: pip install gunicorn")
+
+    module_name, default_bind = SERVICES[service]
+
+    class Application(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": bind or default_bind,
+                "workers": workers or SERVE_WORKERS,
+                "threads": threads or SERVE_THREADS,
+                "worker_class": "gthread",
+                "timeout": SERVE_TIMEOUT,
+                "post_worker_init": _post_worker_init(module_name),
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return importlib.import_module(module_name).app
+
+    Application().run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a price service with gunicorn")
+    parser.add_argument("service", choices=sorted(SERVICES))
+    parser.add_argument("--bind", help="host:port (default depends on the service)")
+    parser.add_argument("--workers", type=int, help=f"worker processes (default {SERVE_WORKERS})")
+    parser.add_argument("--threads", type=int, help=f"threads per worker (default {SERVE_THREADS})")
+    args = parser.parse_args(argv)
+    run(args.service, args.bind, args.workers, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+# Import time budget (milliseconds, median over the runs) for the CLI entry points
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "500"))
+CLI_MODULES = ["check_price", "price_monitor"]
+# Modules the CLI check path must not load; they belong to the export and server paths
+HEAVY_MODULES = ["pandas", "numpy", "flask", "pyarrow", "openpyxl", "decouple"]
+
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"import_ms": elapsed * 1000, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+# Function to import a module in a fresh interpreter; returns import time, process time and heavy modules
+def measure(module, workdir):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                            cwd=workdir, env=env, capture_output=True, text=True, check=True).stdout
+    process_ms = (time.perf_counter() - start) * 1000
+    # Entry points may print on import; the probe result is the last line
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_ms"] = process_ms
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold start benchmark for the CLI entry points")
+    parser.add_argument("--modules", default=",".join(CLI_MODULES))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="price-startup-")
+    report = {}
+    failed = False
+    print(f"{'module':<16}{'import ms':>12}{'process ms':>12}  heavy modules")
+    for module in [name.strip() for name in args.modules.split(",") if name.strip()]:
+        runs = [measure(module, workdir) for _ in range(args.runs)]
+        import_ms = statistics.median(run["import_ms"] for run in runs)
+        process_ms = statistics.median(run["process_ms"] for run in runs)
+        heavy = sorted({name for run in runs for name in run["heavy"]})
+        over = import_ms > args.budget_ms
+        failed = failed or over or bool(heavy)
+        report[module] = {"import_ms": round(import_ms, 1), "process_ms": round(process_ms, 1),
+                          "heavy": heavy, "over_budget": over}
+        print(f"{module:<16}{import_ms:>12.1f}{process_ms:>12.1f}  {', '.join(heavy) or '-'}"
+              f"{'  OVER BUDGET' if over else ''}")
+    print(f"Budget: {args.budget_ms:.0f} ms import time per module, no {', '.join(HEAVY_MODULES)}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
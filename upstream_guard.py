@@ -0,0 +1,134 @@
+import os
+import time
+import logging
+import threading
+
+from metrics import registry, Counter
+
+# Token bucket for upstream lookups: sustained requests per second (0 = unlimited) and burst size
+UPSTREAM_RATE = float(os.getenv("UPSTREAM_RATE", "20"))
+UPSTREAM_BURST = float(os.getenv("UPSTREAM_BURST", "40"))
+# Circuit breaker: open after this many consecutive failures, probe again after the reset timeout
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+BREAKER_HALF_OPEN_MAX = int(os.getenv("BREAKER_HALF_OPEN_MAX", "1"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+SHORT_CIRCUITED = registry.register(Counter(
+    "price_upstream_short_circuited_total", "Lookups failed fast because the circuit breaker was open."))
+BREAKER_TRANSITIONS = registry.register(Counter(
+    "price_upstream_breaker_transitions_total", "Circuit breaker state changes.", labels=("state",)))
+
+
+# Token bucket limiter; acquire() blocks until a token is available
+class TokenBucket:
+    def __init__(self, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+# Circuit breaker: closed -> open after consecutive failures -> half open after the reset timeout,
+# where a limited number of probe calls decide between closed and open again
+class CircuitBreaker:
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT,
+                 half_open_max=BREAKER_HALF_OPEN_MAX, name="upstream"):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = max(1, half_open_max)
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probes = 0
+
+    def _transition(self, state):
+        if state != self.state:
+            logging.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+            BREAKER_TRANSITIONS.inc(state)
+            self.state = state
+
+    # Function to check whether a call may go through; False means fail fast
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    SHORT_CIRCUITED.inc()
+                    return False
+                self._transition(HALF_OPEN)
+                self._probes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_max:
+                    SHORT_CIRCUITED.inc()
+                    return False
+                self._probes += 1
+            return True
+
+    # Function to give back the probe slot of a call that ended as neither success nor failure
+    # (a local error), so half open does not wait forever for its result
+    def release(self):
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._transition(OPEN)
+
+    def status(self):
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)), 1)
+            return {"state": self.state, "consecutive_failures": self.failures, "retry_in": retry_in}
+
+
+# Shared by every upstream lookup in the process
+upstream_bucket = TokenBucket()
+upstream_breaker = CircuitBreaker()
+
+
+def _breaker_metrics():
+    state = upstream_breaker.status()["state"]
+    lines = ["# HELP price_upstream_breaker_state Circuit breaker state (1 for the current state).",
+             "# TYPE price_upstream_breaker_state gauge"]
+    for name in (CLOSED, OPEN, HALF_OPEN):
+        lines.append(f'price_upstream_breaker_state{{state="{name}"}} {int(state == name)}')
+    return lines
+
+
+registry.add_collector(_breaker_metrics)
@@ -0,0 +1,163 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+
+from price_store import PRICE_DB_FILE
+from exporter import EXPORT_FORMATS
+
+# Max number of codes per watchlist and per codes= request
+WATCHLIST_MAX_CODES = int(os.getenv("WATCHLIST_MAX_CODES", "5000"))
+
+# Product codes are short ids like MLA12976; anything else is rejected instead of being fetched
+CODE_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watchlist (
+    name TEXT PRIMARY KEY,
+    codes TEXT NOT NULL,
+    chat_id TEXT,
+    export TEXT,
+    active INTEGER NOT NULL DEFAULT 1,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+# Function to parse codes from a comma separated string or a list: blanks are dropped, duplicates
+# removed (first one wins) and invalid codes raise ValueError
+def parse_codes(value, max_codes=WATCHLIST_MAX_CODES):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    elif not isinstance(value, (list, tuple)) or not all(isinstance(code, str) for code in value):
+        raise ValueError("codes harus berupa teks dipisah koma atau list teks")
+    codes = list(dict.fromkeys(code.strip() for code in value if code.strip()))
+    invalid = [code for code in codes if not CODE_PATTERN.match(code)]
+    if invalid:
+        raise ValueError(f"Kode tidak valid: {', '.join(invalid[:10])}")
+    if max_codes and len(codes) > max_codes:
+        raise ValueError(f"Maksimal {max_codes} kode, diterima {len(codes)}")
+    return codes
+
+
+# Function to merge the codes of several watchlists, each code once, in first-seen order
+def union_codes(watchlists):
+    return list(dict.fromkeys(code for watchlist in watchlists for code in watchlist["codes"]))
+
+
+# Named code lists kept on the server (e.g. per game or operator), each with its own Telegram chat
+# and optional export format. Stored next to the prices, so every worker sees the same lists.
+class WatchlistStore:
+    def __init__(self, path=PRICE_DB_FILE):
+        self.path = path
+        self._local = threading.local()
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(row):
+        name, codes, chat_id, export, active, created_at, updated_at = row
+        return {"name": name, "codes": json.loads(codes), "chat_id": chat_id, "export": export,
+                "active": bool(active), "created_at": created_at, "updated_at": updated_at}
+
+    # Function to list the watchlists (only active ones when active_only), by name
+    def list(self, active_only=False):
+        query = "SELECT name, codes, chat_id, export, active, created_at, updated_at FROM watchlist"
+        if active_only:
+            query += " WHERE active = 1"
+        return [self._row(row) for row in self._connect().execute(query + " ORDER BY name")]
+
+    def active(self):
+        return self.list(active_only=True)
+
+    def get(self, name):
+        row = self._connect().execute(
+            "SELECT name, codes, chat_id, export, active, created_at, updated_at FROM watchlist WHERE name = ?",
+            (name,),
+        ).fetchone()
+        return self._row(row) if row else None
+
+    # Function to create or replace a watchlist; returns it as stored
+    def put(self, name, codes, chat_id=None, export=None, active=True):
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO watchlist (name, codes, chat_id, export, active, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET codes = excluded.codes, "
+            "chat_id = excluded.chat_id, export = excluded.export, active = excluded.active, "
+            "updated_at = excluded.updated_at",
+            (name, json.dumps(list(codes)), chat_id, export, int(bool(active)), now, now),
+        )
+        return self.get(name)
+
+    # Function to delete a watchlist; returns False when it did not exist
+    def delete(self, name):
+        return self._connect().execute("DELETE FROM watchlist WHERE name = ?", (name,)).rowcount > 0
+
+    def stats(self):
+        watchlists = self.list()
+        active = [watchlist for watchlist in watchlists if watchlist["active"]]
+        return {"watchlists": len(watchlists), "active": len(active),
+                "codes": sum(len(watchlist["codes"]) for watchlist in active),
+                "unique_codes": len(union_codes(active))}
+
+
+# Function to create or update a watchlist from a JSON body; fields left out keep their stored value
+# (codes is required for a new list). Raises ValueError on bad input. Returns (watchlist, created).
+def watchlist_put(store, name, body):
+    if not NAME_PATTERN.match(name or ""):
+        raise ValueError("Nama watchlist hanya boleh huruf, angka, '_' dan '-' (maks 64 karakter)")
+    if not isinstance(body, dict):
+        raise ValueError("Body harus berupa objek JSON")
+    current = store.get(name)
+    if "codes" in body:
+        codes = parse_codes(body["codes"])
+    elif current is not None:
+        codes = current["codes"]
+    else:
+        codes = []
+    if not codes:
+        raise ValueError("Parameter codes wajib diisi")
+    chat_id = body.get("chat_id", current["chat_id"] if current else None)
+    # bool is an int subclass, but true/false is never a chat id
+    if chat_id is not None and (isinstance(chat_id, bool) or not isinstance(chat_id, (str, int))):
+        raise ValueError("chat_id harus berupa teks, angka atau null")
+    export = body.get("export", current["export"] if current else None)
+    if export is not None and not isinstance(export, str):
+        raise ValueError("export harus berupa teks atau null")
+    export = export or None
+    if export is not None and export not in EXPORT_FORMATS:
+        raise ValueError(f"Format export tidak dikenal: {export!r} (pilihan: {', '.join(EXPORT_FORMATS)})")
+    active = body.get("active", current["active"] if current else True)
+    if not isinstance(active, bool):
+        raise ValueError("active harus berupa true atau false")
+    watchlist = store.put(name, codes, None if chat_id in (None, "") else str(chat_id), export, active)
+    return watchlist, current is None
+
+
+# Function to read the codes of a request: ?codes=A,B and/or ?watchlist=name1,name2 (store may be
+# None when watchlists are not available). Raises ValueError on invalid codes or unknown lists.
+def request_codes(args, store=None):
+    codes = parse_codes(args.get("codes"))
+    names = [name.strip() for name in (args.get("watchlist") or "").split(",") if name.strip()]
+    if names and store is None:
+        raise ValueError("Parameter watchlist tidak didukung di sini")
+    for name in names:
+        watchlist = store.get(name)
+        if watchlist is None:
+            raise ValueError(f"Watchlist tidak ditemukan: {name}")
+        codes.extend(watchlist["codes"])
+    return list(dict.fromkeys(codes))